@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" Run time of the simulator event engine versus the number of tasks
+
+Usage:
+    python benchmarks/bench_event_queue.py [--counts 1000 10000 ...]
+
+For every task count, tasks are generated by randomTasks and three
+measurements are printed:
+
+  queue:  push one TASK_READY event per task and drain the event queue
+  legacy: the same with the former sort-on-insert list queue
+  run:    a full QAMTSimulator.run with ToyScheduler
+"""
+
+import argparse
+import time
+
+from qamts.annealer import Chimera
+from qamts.scheduler import ToyScheduler
+from qamts.simulator import Event, EventQueue, QAMTSimulator
+from qamts.task import Task
+from qamts.utils import randomTasks
+
+
+class LegacyEventQueue:
+    """ The list based event queue QAMTSimulator used before EventQueue
+    """
+
+    def __init__(self):
+        self.queue = []
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, e):
+        self.queue.insert(0, e)
+        self.queue = sorted(self.queue, key=lambda x: x.time)
+
+    def pop(self):
+        t = self.queue[0].time
+        events = [e for e in self.queue if e.time == t]
+        self.queue = [e for e in self.queue if e.time > t]
+        return t, events
+
+
+def drain(queue, tasks):
+    t_start = time.perf_counter()
+    for t in tasks:
+        queue.push(Event.taskReady(t))
+    while len(queue):
+        queue.pop()
+    return time.perf_counter() - t_start
+
+
+def run(tasks):
+    t_start = time.perf_counter()
+    sim = QAMTSimulator(tasks, Chimera(), ToyScheduler())
+    sim.run()
+    return time.perf_counter() - t_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=10000, help='largest task count for the legacy queue')
+    parser.add_argument('--run-max', type=int, default=1000000, help='largest task count for a full run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f'{"tasks":>10} {"queue (s)":>12} {"legacy (s)":>12} {"run (s)":>12}')
+    for num in args.counts:
+        tasks = Task.load(randomTasks(num, anneal_time=100, seed=args.seed))
+        t_queue = drain(EventQueue(), tasks)
+        t_legacy = drain(LegacyEventQueue(), tasks) if num <= args.legacy_max else float('nan')
+        t_run = run(tasks) if num <= args.run_max else float('nan')
+        print(f'{num:>10} {t_queue:>12.4f} {t_legacy:>12.4f} {t_run:>12.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Compare fitDemand against the former convolve2d implementation
+
+Usage:
+    python benchmarks/bench_fit_demand.py [--sizes 16 64 256] [--repeat 20]
+
+For every grid size the device is half filled with random rectangles, then
+a mix of rectangular demands is fitted with both implementations. The
+allocations and scores are checked to be identical.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.signal import convolve2d
+
+from qamts.scheduling_algorithms import fitDemand
+
+
+def fitDemandConvolve(res, dmd, return_score=False):
+    """ fitDemand as it was implemented with scipy convolve2d
+    """
+    cross = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+    feasible = convolve2d(res, dmd, mode='valid')
+    feasible_pad = np.pad(feasible, 1, 'constant', constant_values=1)
+    scores = convolve2d(feasible_pad, cross, mode='same')[1:-1, 1:-1]
+    scores = (1-feasible.astype(bool)) * scores
+    best_score = scores.max()
+    if best_score > 0:
+        ind = np.unravel_index(np.argmax(scores, axis=None), scores.shape)
+        alloc = np.zeros_like(res, dtype=int)
+        alloc[ind[0]:ind[0]+dmd.shape[0], ind[1]:ind[1]+dmd.shape[1]] += dmd
+    else:
+        alloc = None
+    return (alloc, best_score) if return_score else alloc
+
+
+def randomOccupancy(size, fill, rng):
+    res = np.zeros((size, size), dtype=int)
+    while res.mean() < fill:
+        h, w = rng.integers(1, max(2, size // 4), size=2, endpoint=True)
+        r, c = rng.integers(0, size - h + 1), rng.integers(0, size - w + 1)
+        res[r:r+h, c:c+w] = 1
+    return res
+
+
+def timeit(func, cases, repeat):
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        out = [func(res, dmd, return_score=True) for res, dmd in cases]
+    return (time.perf_counter() - t_start) / repeat / len(cases), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--demands', type=int, default=20, help='number of demands per grid')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f'{"grid":>8} {"convolve2d (ms)":>16} {"fitDemand (ms)":>16} {"speedup":>8}')
+    for size in args.sizes:
+        res = randomOccupancy(size, 0.5, rng)
+        cases = [(res, np.ones(rng.integers(1, size // 2, size=2, endpoint=True), dtype=int))
+                 for _ in range(args.demands)]
+        t_ref, out_ref = timeit(fitDemandConvolve, cases, args.repeat)
+        t_new, out_new = timeit(fitDemand, cases, args.repeat)
+        for (a_ref, s_ref), (a_new, s_new) in zip(out_ref, out_new):
+            assert s_ref == s_new and (a_ref is None) == (a_new is None)
+            assert a_ref is None or np.array_equal(a_ref, a_new)
+        print(f'{size:>3}x{size:<4} {t_ref*1e3:>16.3f} {t_new*1e3:>16.3f} {t_ref/t_new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
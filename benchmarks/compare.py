@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+""" Compare two result files of benchmarks/suite.py
+
+Usage:
+    python benchmarks/compare.py base.json new.json [--threshold 0.1]
+
+Benchmarks are matched by group, name and parameters. The ratio of the new
+time to the base time is printed for each, and the peak memory ratio for
+runs. The exit status is 1 if any benchmark is slower by more than the
+threshold, so the script can gate a CI job.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report['meta'], {key(r): r for r in report['results']}
+
+
+def key(result):
+    return result['group'], result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print(f'base {base_meta["commit"]}\nnew  {new_meta["commit"]}\n')
+    print(f'{"group":<10} {"name":<34} {"params":<40} {"base":>10} {"new":>10} {"ratio":>7} {"memory":>7}')
+
+    regressions = 0
+    for k, b in base.items():
+        n = new.get(k)
+        if n is None or 'seconds' not in b or 'seconds' not in n:
+            continue
+        ratio = n['seconds'] / b['seconds']
+        memory = f'{n["peak_bytes"] / b["peak_bytes"]:>7.2f}' if 'peak_bytes' in b and 'peak_bytes' in n else f'{"":>7}'
+        flag = ''
+        if ratio > 1 + args.threshold:
+            regressions += 1
+            flag = ' slower'
+        group, name, params = k
+        print(f'{group:<10} {name:<34} {params:<40} {b["seconds"]:>10.4f} {n["seconds"]:>10.4f} {ratio:>7.2f} {memory}{flag}')
+
+    print(f'\n{regressions} regressions above {args.threshold:.0%}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
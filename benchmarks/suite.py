@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+""" Reproducible benchmark suite of the placement algorithms and schedulers
+
+Usage:
+    python benchmarks/suite.py [--quick] [--output results.json]
+    python benchmarks/compare.py base.json new.json
+
+Two groups of benchmarks are run, with fixed seeds:
+
+  placement: fitDemandWithRotateFlip on half occupied grids, and nextFit,
+             firstFit and maxRectsFit packing a batch of demands onto an
+             empty grid, for every grid size and demand mix
+  run:       QAMTSimulator.run of randomTasks with every scheduler and task
+             count, with the peak memory of the run traced by tracemalloc
+
+A run is skipped if the same scheduler took longer than --budget seconds
+at a smaller task count. Results are written as JSON together with the git
+commit, so runs on different commits can be compared by compare.py.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from qamts import scheduler as schedulers
+from qamts.annealer import Chimera
+from qamts.bitboard import BitBoard
+from qamts.scheduling_algorithms import firstFit, fitDemandWithRotateFlip, maxRectsFit, nextFit
+from qamts.simulator import QAMTSimulator
+from qamts.task import Task
+from qamts.utils import randomTasks
+
+SCHEDULERS = ['ToyScheduler', 'NaiveScheduler', 'StaticScheduler', 'NextFitTaskPreemption', 'IncrementalScheduler', 'TimeSliceScheduler', 'DynamicScheduler', 'EDFScheduler', 'LeastLaxityScheduler']
+
+MIXES = ['small', 'large', 'irregular']
+
+
+def gitCommit():
+    """ The commit of the working tree, with '-dirty' if it has changes
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def randomDemands(size, mix, num, rng):
+    """ Demands of a mix: small or large rectangles, or irregular shapes
+    """
+    dmds = []
+    for _ in range(num):
+        if mix == 'small':
+            dmds.append(np.ones(rng.integers(1, max(1, size // 8), size=2, endpoint=True), dtype=int))
+        elif mix == 'large':
+            dmds.append(np.ones(rng.integers(size // 4, size // 2, size=2, endpoint=True), dtype=int))
+        else:
+            dmd = (rng.random(rng.integers(2, max(2, size // 4), size=2, endpoint=True)) < 0.7).astype(int)
+            dmd[0, 0] = dmd[-1, -1] = 1
+            dmds.append(dmd)
+    return dmds
+
+
+def randomOccupancy(size, fill, rng):
+    res = np.zeros((size, size), dtype=int)
+    while res.mean() < fill:
+        h, w = rng.integers(1, max(2, size // 4), size=2, endpoint=True)
+        r, c = rng.integers(0, size - h + 1), rng.integers(0, size - w + 1)
+        res[r:r+h, c:c+w] = 1
+    return res
+
+
+def measure(func, repeat):
+    """ Returns:
+      The run times in seconds of repeat calls of func
+    """
+    times = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    return times
+
+
+def placementBenchmarks(sizes, num, repeat, seed):
+    results = []
+    for size in sizes:
+        for mix in MIXES:
+            rng = np.random.default_rng(seed)
+            dmds = randomDemands(size, mix, num, rng)
+            res = randomOccupancy(size, 0.5, rng)
+            reqs = [(i, d, 1) for i, d in enumerate(dmds)]
+            empty = np.zeros((size, size), dtype=int)
+
+            cases = {
+                'fitDemandWithRotateFlip': lambda: [fitDemandWithRotateFlip(res, d) for d in dmds],
+                'fitDemandWithRotateFlip[BitBoard]': lambda: [fitDemandWithRotateFlip(BitBoard.fromArray(res), d) for d in dmds],
+                'nextFit': lambda: nextFit(reqs, empty),
+                'firstFit': lambda: firstFit(reqs, empty),
+                'maxRectsFit': lambda: maxRectsFit(reqs, empty),
+            }
+            for name, func in cases.items():
+                times = measure(func, repeat)
+                results.append({
+                    'group': 'placement',
+                    'name': name,
+                    'params': {'grid': size, 'mix': mix, 'demands': num},
+                    'seconds': min(times),
+                    'times': times,
+                })
+                print(f'placement {name:<34} {size:>4} {mix:<10} {min(times)*1e3:>10.2f} ms', flush=True)
+    return results
+
+
+def simulate(scheduler, num, seed):
+    tasks = Task.load(randomTasks(num, anneal_time=100, seed=seed))
+    sim = QAMTSimulator(tasks, Chimera(), getattr(schedulers, scheduler)(), retention='metrics')
+    sim.run()
+    return sim
+
+
+def runBenchmarks(names, counts, budget, seed, memory=True):
+    results = []
+    for scheduler in names:
+        for num in sorted(counts):
+            row = {'group': 'run', 'name': scheduler, 'params': {'tasks': num}}
+            slow = [r for r in results if r['name'] == scheduler and r.get('seconds', budget) >= budget]
+            if slow:
+                row['skipped'] = True
+                results.append(row)
+                print(f'run {scheduler:<24} {num:>8} skipped', flush=True)
+                continue
+
+            t_start = time.perf_counter()
+            sim = simulate(scheduler, num, seed)
+            row['seconds'] = time.perf_counter() - t_start
+            row['sim_time'] = sim.getTime()
+            row['utilisation'] = sim.getUtilisation()
+
+            if memory:
+                tracemalloc.start()
+                simulate(scheduler, num, seed)
+                row['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            results.append(row)
+            print(f'run {scheduler:<24} {num:>8} {row["seconds"]:>10.2f} s {row.get("peak_bytes", 0)/2**20:>8.1f} MiB', flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=None, help='the JSON results file, benchmarks/results/<commit>.json by default')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help='grid sizes of placement')
+    parser.add_argument('--demands', type=int, default=50, help='number of demands per placement benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--schedulers', nargs='+', default=SCHEDULERS)
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000], help='task counts of runs')
+    parser.add_argument('--budget', type=float, default=60, help='skip larger runs of a scheduler once a run takes this many seconds')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the peak memory of runs')
+    parser.add_argument('--quick', action='store_true', help='small sizes and counts, for a smoke test')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.demands, args.repeat, args.counts = [16, 64], 10, 1, [100, 300]
+
+    commit = gitCommit()
+    results = placementBenchmarks(args.sizes, args.demands, args.repeat, args.seed)
+    results += runBenchmarks(args.schedulers, args.counts, args.budget, args.seed, memory=not args.no_memory)
+
+    report = {
+        'meta': {
+            'commit': commit,
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+
+    if args.output:
+        path = args.output
+    else:
+        name = 'unknown' if commit is None else commit[:12] + ('-dirty' if commit.endswith('-dirty') else '')
+        path = f'benchmarks/results/{name}.json'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
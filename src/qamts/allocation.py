@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class Allocation:
+
+    def __init__(self, origin, dmd, shape):
+        """ A demand placed on a device. Only the origin and a reference to
+            the placed demand are kept, the bitmap of the whole device is
+            built on request.
+
+        Args:
+          origin: (row, col) of the top left corner of the demand
+          dmd: a 2D bitmap of the demand in the orientation it is placed
+          shape: (rows, cols) of the device
+        """
+        self.origin = tuple(int(i) for i in origin)
+        self.dmd = dmd
+        self.shape = tuple(shape)
+
+
+    def __repr__(self):
+        return f'Allocation({self.origin}, {self.dmd.shape}, {self.shape})'
+
+
+    def __array__(self, dtype=None, copy=None):
+        alloc = self.toArray()
+        return alloc if dtype is None else alloc.astype(dtype)
+
+
+    @property
+    def size(self):
+        """ The capacity of the device, same as the size of the bitmap
+        """
+        return self.shape[0] * self.shape[1]
+
+
+    @property
+    def slices(self):
+        """ The bounding box of the allocation on the device
+        """
+        (r, c), (h, w) = self.origin, self.dmd.shape
+        return slice(r, r+h), slice(c, c+w)
+
+
+    def sum(self):
+        return self.dmd.sum()
+
+
+    def toArray(self):
+        """ The 2D bitmap of the allocation on the whole device
+        """
+        alloc = np.zeros(self.shape, dtype=int)
+        alloc[self.slices] += self.dmd
+        return alloc
+
+
+    def addTo(self, res):
+        """ Mark the allocation as occupied in a 2D bitmap or a BitBoard of
+            resource usage, in place
+        """
+        if isinstance(res, np.ndarray):
+            res[self.slices] += self.dmd
+        else:
+            res += self
+        return res
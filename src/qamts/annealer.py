@@ -2,7 +2,20 @@ import numpy as np
 
 class Chimera:
 
-    def __init__(self, resources=None):
+    def __init__(self, resources=None, program_time=12000, name=None, pipelined=False, reuse_program=False):
+        """ A Chimera annealer
+
+        Args:
+          resources: the resource usage map, or (rows, cols) of unit cells.
+                     16x16 by default.
+          program_time: time in microseconds to program an instruction
+          name: the name of the annealer in a cluster
+          pipelined: program the next instruction while the current one is
+                     sampling. The annealer takes the next instruction as
+                     soon as the current one starts sampling.
+          reuse_program: skip programming an instruction with the same
+                         tasks and allocations as the last one
+        """
 
         if resources is None:
             self.res = np.zeros((16, 16), dtype=int)
@@ -11,16 +24,29 @@ class Chimera:
         else:
             self.res = resources
 
+        self.program_time = program_time
+        self.name = name
+        self.pipelined = pipelined
+        self.reuse_program = reuse_program
+
         self.last_inst = None
         self.idle = True
 
+        # the time the sampling of the last instruction ends
+        self.t_sample_free = 0
+        self.n_programs = 0
+        self.n_reused = 0
+        self.t_programming = 0
+
 
     def getRes(self):
         return self.res.copy()
 
 
     def getProgramTime(self, inst):
-        return 12000
+        if self.reuse_program and self.last_inst is not None and sameProgram(inst, self.last_inst):
+            return 0
+        return self.program_time
 
 
     def getLastInst(self):
@@ -40,27 +66,52 @@ class Chimera:
 
 
     def execute(self, inst, t):
+        """ Program and sample an instruction from time t. Sampling waits
+            for the sampling of the last instruction to end, which only
+            happens when pipelined.
+
+        Returns:
+          The time the instruction completes
+        """
 
         num_reads = inst.getNumReads()
 
         t_prog = self.getProgramTime(inst)
         t_neal = inst.getAnnealTime()
         t_samp = t_neal * num_reads
-        t_exec = t_prog + t_samp
+        t_sample_start = max(t + t_prog, self.t_sample_free)
+        t_end = t_sample_start + t_samp
 
         for task in inst.getTasks():
             if t_prog > 0:
                 task.log('program', (t,        t_prog),                  1)
-                task.log('sample',  (t+t_prog, t+t_prog+t_neal), num_reads)
-            else:
-                task.log('sample',  (t,        t+t_neal),        num_reads)
+            task.log('sample',  (t_sample_start, t_sample_start+t_neal), num_reads)
             task.samplePlusOne(num_reads)
 
         inst.stampTime(t_start=t,
-                  t_end=t+t_exec,
+                  t_end=t_end,
                   t_prog=t_prog,
                   t_sample=t_samp)
 
+        if t_prog > 0:
+            self.n_programs += 1
+            self.t_programming += t_prog
+        else:
+            self.n_reused += 1
+
         self.last_inst = inst
+        self.t_sample_free = t_end
+
+        return t_end
+
 
-        return t + t_exec
+def sameProgram(a, b):
+    """ Check if two instructions place the same tasks in the same way, so
+        the annealer programmed for one can run the other
+    """
+    if len(a.tasks) != len(b.tasks):
+        return False
+    for ta, tb, aa, ab in zip(a.tasks, b.tasks, a.allocs, b.allocs):
+        if ta != tb or aa.origin != ab.origin or aa.dmd.shape != ab.dmd.shape or not np.array_equal(aa.dmd, ab.dmd):
+            return False
+    return a.getAnnealTime() == b.getAnnealTime()
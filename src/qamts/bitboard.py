@@ -0,0 +1,171 @@
+import numpy as np
+
+from .allocation import Allocation
+
+
+def popcount(x):
+    return bin(x).count('1')
+
+
+def packRows(bitmap):
+    """ Pack every row of a 2D bitmap into a Python int, bit j of a row is
+        column j of the bitmap.
+    """
+    bitmap = np.asarray(bitmap).astype(bool)
+    packed = np.packbits(bitmap, axis=1, bitorder='little')
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+
+class BitBoard:
+
+    def __init__(self, shape, rows=None):
+        """ A compact resource usage map, each row of unit cells is packed
+            into a Python int. It stands in for the 2D bitmap of resource
+            usage taken by fitDemand, nextFit and firstFit.
+
+            It uses far less memory than the dense bitmap, but its scoring
+            loops run in Python, so fitting is several times slower than the
+            vectorised dense path. Schedulers only use it when packed=True.
+
+        Args:
+          shape: (rows, cols) of the device
+          rows: a list of ints, one per row. None means all free.
+        """
+        self.shape = tuple(shape)
+        self.rows = list(rows) if rows is not None else [0] * self.shape[0]
+
+
+    def __repr__(self):
+        return f'BitBoard({self.shape}, {self.sum()} occupied)'
+
+
+    @staticmethod
+    def fromArray(res):
+        return BitBoard(res.shape, packRows(res))
+
+
+    def toArray(self):
+        rows, cols = self.shape
+        packed = np.frombuffer(b''.join(r.to_bytes((cols + 7) // 8, 'little') for r in self.rows), dtype=np.uint8)
+        bits = np.unpackbits(packed.reshape(rows, -1), axis=1, count=cols, bitorder='little')
+        return bits.astype(int)
+
+
+    def copy(self):
+        return BitBoard(self.shape, self.rows)
+
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+
+    def sum(self):
+        return sum(popcount(r) for r in self.rows)
+
+
+    def __iadd__(self, alloc):
+        """ Mark the resources of an allocation as occupied
+        """
+        if isinstance(alloc, Allocation):
+            r, c = alloc.origin
+            for k, d in enumerate(packRows(alloc.dmd), start=r):
+                self.rows[k] |= d << c
+            return self
+        other = alloc.rows if isinstance(alloc, BitBoard) else packRows(alloc)
+        self.rows = [r | o for r, o in zip(self.rows, other)]
+        return self
+
+
+    def overlap(self, dmd_rows, i, j):
+        """ Number of occupied resources under the demand placed at (i, j)
+        """
+        return sum(popcount((self.rows[i+k] >> j) & d) for k, d in enumerate(dmd_rows))
+
+
+    def feasible(self, dmd):
+        """ Find the positions where the demand fits
+
+        Args:
+          dmd: a 2D bitmap of demand. 1 means required.
+
+        Returns:
+          dmd_rows: the demand packed by packRows
+          free: a list of ints, one per row of positions, bit j is set if the
+                demand fits at that position. None if the demand is larger
+                than the device.
+        """
+        (H, W), (h, w) = self.shape, dmd.shape
+        if h > H or w > W:
+            return None, None
+
+        dmd_rows = packRows(dmd)
+        # blocked[k][r] has bit j set if placing row k of the demand at
+        # column j of row r would overlap an occupied resource
+        shifted = {}
+        for d in set(dmd_rows):
+            bits = [b for b in range(w) if d >> b & 1]
+            if bits == list(range(w)):
+                # a run of ones, OR w shifts together by doubling
+                blocked = self.rows
+                span = 1
+                while span < w:
+                    s = min(span, w - span)
+                    blocked = [r | r >> s for r in blocked]
+                    span += s
+            else:
+                blocked = [0] * H
+                for b in bits:
+                    blocked = [x | r >> b for x, r in zip(blocked, self.rows)]
+            shifted[d] = blocked
+
+        valid = (1 << (W - w + 1)) - 1
+        free = []
+        for i in range(H - h + 1):
+            blocked = 0
+            for k, d in enumerate(dmd_rows):
+                blocked |= shifted[d][i+k]
+            free.append(~blocked & valid)
+
+        return dmd_rows, free
+
+
+    def fitScore(self, dmd):
+        """ Find the best position of the demand, with the same edge-contact
+            score and tie-breaking as fitDemand on a 2D bitmap.
+
+        Returns:
+          position: (row, col) of the best fit, None if it does not fit
+          score: the score of the fit, 0 means does not fit
+        """
+        dmd_rows, free = self.feasible(dmd)
+        if not free:
+            return None, 0
+
+        n_rows, valid = len(free), (1 << (self.shape[1] - dmd.shape[1] + 1)) - 1
+        counts = {}
+
+        def neighbour(i, j):
+            if i < 0 or i >= n_rows or j < 0 or j > valid.bit_length() - 1:
+                return 1
+            if free[i] >> j & 1:
+                return 0
+            if (i, j) not in counts:
+                counts[i, j] = self.overlap(dmd_rows, i, j)
+            return counts[i, j]
+
+        best = None, 0
+        for i, row in enumerate(free):
+            up = free[i-1] if i > 0 else 0
+            down = free[i+1] if i < n_rows - 1 else 0
+            # positions with all four neighbours free score 0, skip them
+            frontier = row & ~(up & down & (row << 1) & (row >> 1))
+            while frontier:
+                low = frontier & -frontier
+                frontier ^= low
+                j = low.bit_length() - 1
+                score = neighbour(i-1, j) + neighbour(i+1, j) + neighbour(i, j-1) + neighbour(i, j+1)
+                if score > best[1]:
+                    best = (i, j), score
+
+        return best
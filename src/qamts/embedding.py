@@ -0,0 +1,266 @@
+import base64
+import hashlib
+from collections import OrderedDict
+from functools import cached_property
+from numbers import Integral
+
+import numpy as np
+
+# the most unit cells of a decoded embedding, far beyond any device
+MAX_EMBEDDING_CELLS = 1 << 24
+
+
+class EmbeddingInfo:
+
+    def __init__(self, embd):
+        """ Data derived from an embedding that placement needs again and
+            again, computed once per distinct embedding when first used.
+        """
+        self.embd = embd
+
+
+    @cached_property
+    def sum(self):
+        return int(self.embd.sum())
+
+
+    @cached_property
+    def all_ones(self):
+        return bool(np.all(self.embd == 1))
+
+
+    @cached_property
+    def orientations(self):
+        return orientations(self.embd)
+
+
+class EmbeddingCache:
+
+    def __init__(self, maxsize=65536):
+        """ Intern embeddings so that tasks with equal embeddings share one
+            read-only array, keyed by shape, dtype and a hash of the content.
+            The least recently interned embeddings are dropped beyond
+            maxsize. Tasks keep their arrays, only the sharing with later
+            tasks and the cached EmbeddingInfo are lost.
+
+        Args:
+          maxsize: the most distinct embeddings kept, None for no limit
+        """
+        self.maxsize = maxsize
+        self.embds = OrderedDict()
+        self.infos = {}
+
+
+    def __len__(self):
+        return len(self.embds)
+
+
+    def intern(self, embd):
+        """ Return the shared read-only copy of an embedding
+        """
+        embd = np.asarray(embd)
+        key = embd.shape, embd.dtype.str, hashlib.blake2b(embd.tobytes(), digest_size=16).digest()
+        shared = self.embds.get(key)
+        if shared is None:
+            shared = embd.copy()
+            shared.flags.writeable = False
+            self.embds[key] = shared
+            self.infos[id(shared)] = shared, EmbeddingInfo(shared)
+            if self.maxsize is not None and len(self.embds) > self.maxsize:
+                _, dropped = self.embds.popitem(last=False)
+                del self.infos[id(dropped)]
+        else:
+            self.embds.move_to_end(key)
+        return shared
+
+
+    def getInfo(self, embd):
+        """ Return the EmbeddingInfo of an embedding, from the cache if the
+            embedding was interned, otherwise freshly computed
+        """
+        shared, info = self.infos.get(id(embd), (None, None))
+        if shared is embd:
+            return info
+        return EmbeddingInfo(embd)
+
+
+    def getSize(self, embd):
+        """ The number of cells of an embedding, without building an
+            EmbeddingInfo for one that was not interned
+        """
+        shared, info = self.infos.get(id(embd), (None, None))
+        if shared is embd:
+            return info.sum
+        return int(np.asarray(embd).sum())
+
+
+    def clear(self):
+        """ Drop all interned embeddings, e.g. between independent runs
+        """
+        self.embds.clear()
+        self.infos.clear()
+
+
+cache = EmbeddingCache()
+
+
+def intern(embd):
+    return cache.intern(embd)
+
+
+def embeddingInfo(embd):
+    return cache.getInfo(embd)
+
+
+def embeddingSize(embd):
+    return cache.getSize(embd)
+
+
+def orientations(dmd: np.ndarray):
+    """ Distinct orientations of a demand, in the order they are tried.
+        A rectangle is rotated by 90 degrees, an irregular shape is also
+        rotated by 180 and 270 degrees and flipped.
+    """
+
+    if np.all(dmd):
+        # a rectangle shape
+        candidates = [np.rot90(dmd, k=angle90) for angle90 in [0, 1]]
+    else:
+        # an irregular shape
+        candidates = []
+        for angle90 in [0, 1, 2, 3]:
+            for flip in [True, False]:
+                dmdt = np.rot90(dmd, k=angle90)
+                candidates.append(np.fliplr(dmdt) if flip else dmdt)
+
+    dmds = []
+    for dmdt in candidates:
+        if not any(d.shape == dmdt.shape and np.array_equal(d, dmdt) for d in dmds):
+            dmds.append(dmdt)
+    return dmds
+
+
+def isInt(n):
+    return isinstance(n, Integral) and not isinstance(n, bool)
+
+
+def decodeEmbedding(spec):
+    """ Build an embedding from its declarative spec, a dict of one of
+
+        {'shape': [r, c]}                       a rectangle of ones
+        {'shape': [r, c], 'rle': [n0, n1, ...]} run lengths of 0s and 1s in
+                                                row-major order, 0s first
+        {'shape': [r, c], 'bits': '...'}        the row-major bitmap packed
+                                                by np.packbits, base64 encoded
+
+    The shape must be two positive ints of at most MAX_EMBEDDING_CELLS
+    cells, and the run lengths non-negative ints.
+
+    Returns:
+      embd: a 2D bitmap of int
+    """
+
+    shape = tuple(spec['shape'])
+    if len(shape) != 2 or not all(isInt(n) and n >= 1 for n in shape):
+        raise ValueError(f'Invalid embedding shape {spec["shape"]}')
+    shape = (int(shape[0]), int(shape[1]))
+    size = shape[0] * shape[1]
+    if size > MAX_EMBEDDING_CELLS:
+        raise ValueError(f'Embedding shape {shape} is larger than {MAX_EMBEDDING_CELLS} cells')
+
+    if 'rle' in spec:
+        runs = list(spec['rle'])
+        if not all(isInt(n) and 0 <= n <= size for n in runs):
+            raise ValueError(f'Invalid run lengths of embedding {spec["rle"]}')
+        if sum(runs) != size:
+            raise ValueError(f'Run lengths of embedding do not add up to its shape {shape}')
+        embd = np.repeat(np.arange(len(runs)) % 2, np.asarray(runs, dtype=int))
+    elif 'bits' in spec:
+        packed = np.frombuffer(base64.b64decode(spec['bits']), dtype=np.uint8)
+        if packed.size != (size + 7) // 8:
+            raise ValueError(f'Bits of embedding do not match its shape {shape}')
+        embd = np.unpackbits(packed, count=size)
+    else:
+        return np.ones(shape, dtype=int)
+
+    return embd.reshape(shape).astype(int)
+
+
+def encodeEmbedding(embd, fmt='rle'):
+    """ Describe an embedding by a declarative spec, see decodeEmbedding.
+        A rectangle of ones is always described by its shape only.
+
+    Args:
+      embd: a 2D bitmap
+      fmt: 'rle' or 'bits', the format of an irregular embedding
+    """
+
+    embd = np.asarray(embd) != 0
+    spec = {'shape': list(embd.shape)}
+    if np.all(embd):
+        return spec
+
+    flat = embd.ravel()
+    if fmt == 'rle':
+        edges = np.flatnonzero(np.diff(flat)) + 1
+        runs = np.diff(np.concatenate(([0], edges, [flat.size])))
+        spec['rle'] = ([0] if flat[0] else []) + runs.tolist()
+    elif fmt == 'bits':
+        spec['bits'] = base64.b64encode(np.packbits(flat).tobytes()).decode('ascii')
+    else:
+        raise ValueError(f'Unknown embedding format {fmt}')
+    return spec
+
+
+def specKey(spec):
+    """ A hashable key of an embedding spec
+    """
+    return tuple(spec['shape']), tuple(spec.get('rle', ())), spec.get('bits')
+
+
+def loadEmbeddings(specs, trusted=False):
+    """ Build the embeddings of many tasks. Each distinct spec is decoded
+        once and interned, so tasks with the same embedding share one array.
+
+    Args:
+      specs: a list of embedding specs, see decodeEmbedding, or arrays.
+             Python source strings evaluating to an array, or assigning it
+             to 'embd', are accepted for compatibility when trusted.
+      trusted: allow Python source strings, which are run by eval/exec
+
+    Returns:
+      A list of interned embeddings
+    """
+
+    decoded = {}
+    embds = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            key = specKey(spec)
+            if key not in decoded:
+                decoded[key] = intern(decodeEmbedding(spec))
+        elif isinstance(spec, str):
+            key = spec
+            if key not in decoded:
+                if not trusted:
+                    raise ValueError(f'Refuse to evaluate embedding {spec!r}, pass trusted=True to evaluate legacy Python source')
+                decoded[key] = intern(evalEmbedding(spec))
+        else:
+            embds.append(intern(spec))
+            continue
+        embds.append(decoded[key])
+    return embds
+
+
+def evalEmbedding(src):
+    """ The legacy embedding format, Python source evaluating to an array or
+        assigning it to 'embd'
+    """
+    try:
+        return eval(src, {'np': np})
+    except SyntaxError:
+        loc = {}
+        exec(src, {'np': np}, loc)
+        if 'embd' not in loc:
+            raise ValueError(f'Invalid embedding {src}')
+        return loc['embd']
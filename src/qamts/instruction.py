@@ -1,3 +1,6 @@
+from .allocation import Allocation
+
+
 class QMI:
 
     def __init__(self, tasks, allocs, num_reads, anneal_time=20):
@@ -51,7 +54,7 @@ class QMI:
     def fromTask(task):
         return QMI(
             tasks=[task],
-            allocs=[task.getEmbd()],
+            allocs=[Allocation((0, 0), task.getEmbd(), task.getEmbd().shape)],
             num_reads=task.getNumReads(),
             anneal_time=task.getAnnealTime(),
         )
@@ -1,32 +1,357 @@
-import numpy as np
+import math
 import time
 
+import numpy as np
+
+from .embedding import embeddingSize
+from .task import NONE
+
+
+METRICS = {
+    'ET': 'execution time, from the start to the end of a task',
+    'RT': 'response time, from the arrival to the end of a task',
+    'IWT': 'initial wait time, from the arrival to the start of a task',
+}
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def taskColumns(tasks, names):
+    """ Gather columns of tasks from their TaskTables into NumPy arrays, in
+        the order of tasks. Times of tasks that have not run are NaN.
+    """
+    out = {n: np.full(len(tasks), np.nan) for n in names}
+    groups = {}
+    for i, t in enumerate(tasks):
+        table, ind, rows = groups.setdefault(id(t.table), (t.table, [], []))
+        ind.append(i)
+        rows.append(t.row)
+    for table, ind, rows in groups.values():
+        for n in names:
+            col = table.column(n)[rows]
+            out[n][ind] = np.where(col == NONE, np.nan, col)
+    return out
+
 
 class TaskTiming:
 
     def __init__(self, tasks):
+        """ Timing metrics of tasks. Arrival, start and end times are read
+            into arrays once, tasks that have not run are ignored.
+        """
         self.tasks = tasks
+        cols = taskColumns(tasks, ['t_arrive', 't_first', 't_last', 'embd_sum'])
+        self.setArrays(cols['t_arrive'], cols['t_first'], cols['t_last'], cols['embd_sum'])
+
+
+    @staticmethod
+    def fromArrays(t_arrive, t_start, t_end, sizes=None):
+        """ Timing metrics of tasks given as arrays of arrival, start and end
+            times and optionally the sizes of their embeddings
+        """
+        tt = TaskTiming([])
+        tt.setArrays(t_arrive, t_start, t_end, sizes)
+        return tt
+
+
+    def setArrays(self, t_arrive, t_start, t_end, sizes=None):
+        self.t_arrive = np.asarray(t_arrive, dtype=float)
+        self.t_start = np.asarray(t_start, dtype=float)
+        self.t_end = np.asarray(t_end, dtype=float)
+        self.sizes = None if sizes is None else np.asarray(sizes)
+        self.values = {
+            'ET': self.t_end - self.t_start,
+            'RT': self.t_end - self.t_arrive,
+            'IWT': self.t_start - self.t_arrive,
+        }
+
 
     def getTiming(self):
         return [(t, t.getTimeArrive(), t.getLogStartTime(), t.getLogEndTime()) for t in self.tasks]
 
+    def count(self):
+        return int(np.count_nonzero(~np.isnan(self.values['RT'])))
+
     def ACET(self):
-        return np.mean([t.getLogEndTime() - t.getLogStartTime() for t in self.tasks])
+        return np.nanmean(self.values['ET'])
 
     def WCET(self):
-        return np.max([t.getLogEndTime() - t.getLogStartTime() for t in self.tasks])
+        return np.nanmax(self.values['ET'])
 
     def ACRT(self):
-        return np.mean([t.getLogEndTime() - t.getTimeArrive() for t in self.tasks])
+        return np.nanmean(self.values['RT'])
 
     def WCRT(self):
-        return np.max([t.getLogEndTime() - t.getTimeArrive() for t in self.tasks])
+        return np.nanmax(self.values['RT'])
 
     def ACIWT(self):
-        return np.mean([t.getLogStartTime() - t.getTimeArrive() for t in self.tasks])
+        return np.nanmean(self.values['IWT'])
 
     def WCIWT(self):
-        return np.max([t.getLogStartTime() - t.getTimeArrive() for t in self.tasks])
+        return np.nanmax(self.values['IWT'])
+
+
+    def percentiles(self, metric='RT', qs=PERCENTILES):
+        """ Percentiles of a metric, see METRICS
+
+        Returns:
+          A dict of percentile to value
+        """
+        return dict(zip(qs, np.nanpercentile(self.values[metric], qs)))
+
+
+    def summary(self, qs=PERCENTILES):
+        """ All metrics in one dict, the average-case and worst-case values
+            of every metric plus its percentiles, e.g. 'RT_p99'. They are
+            NaN when no task has completed.
+        """
+        summary = {'count': self.count()}
+        if summary['count'] == 0:
+            for metric in METRICS:
+                summary[f'AC{metric}'] = summary[f'WC{metric}'] = np.nan
+                for q in qs:
+                    summary[f'{metric}_p{q:g}'] = np.nan
+            return summary
+        for metric in METRICS:
+            summary[f'AC{metric}'] = np.nanmean(self.values[metric])
+            summary[f'WC{metric}'] = np.nanmax(self.values[metric])
+            for q, v in self.percentiles(metric, qs).items():
+                summary[f'{metric}_p{q:g}'] = v
+        return summary
+
+
+    def bySize(self, bins=10, capacity=None, qs=PERCENTILES):
+        """ Break the metrics down by the size of the task embeddings
+
+        Args:
+          bins: number of equal-width size classes, or the edges of them
+          capacity: the size of the device. If given, sizes are fractions of
+                    the device, otherwise numbers of unit cells.
+
+        Returns:
+          A list of (size_low, size_high, summary) per non-empty class
+        """
+        if self.sizes is None:
+            raise ValueError('bySize needs the sizes of tasks, pass sizes to TaskTiming.fromArrays')
+        sizes = self.sizes / capacity if capacity else self.sizes
+        edges = np.histogram_bin_edges(sizes, bins=bins)
+        classes = np.clip(np.digitize(sizes, edges) - 1, 0, len(edges) - 2)
+        breakdown = []
+        for c in range(len(edges) - 1):
+            mask = classes == c
+            if np.any(mask):
+                tt = TaskTiming.fromArrays(self.t_arrive[mask], self.t_start[mask], self.t_end[mask], self.sizes[mask])
+                breakdown.append((edges[c], edges[c+1], tt.summary(qs)))
+        return breakdown
+
+
+class DeadlineMetrics:
+
+    def __init__(self, tasks):
+        """ Deadline metrics of tasks. Only tasks with a deadline count, a
+            task that has not completed misses its deadline.
+        """
+        cols = taskColumns(tasks, ['t_last', 'deadline', 'priority'])
+        self.setArrays(cols['t_last'], cols['deadline'], cols['priority'])
+
+
+    @staticmethod
+    def fromArrays(t_end, deadline, priority=None):
+        """ Deadline metrics of tasks given as arrays of end times and
+            deadlines, NaN for tasks that have not completed or have no
+            deadline
+        """
+        dm = DeadlineMetrics([])
+        dm.setArrays(t_end, deadline, priority)
+        return dm
+
+
+    def setArrays(self, t_end, deadline, priority=None):
+        t_end = np.asarray(t_end, dtype=float)
+        deadline = np.asarray(deadline, dtype=float)
+        has_deadline = ~np.isnan(deadline)
+        self.t_end = t_end[has_deadline]
+        self.deadline = deadline[has_deadline]
+        self.priority = None if priority is None else np.asarray(priority)[has_deadline]
+        # the time a task completes past its deadline, inf if it has not
+        self.tardiness = np.maximum(np.where(np.isnan(self.t_end), np.inf, self.t_end) - self.deadline, 0)
+
+
+    def count(self):
+        return len(self.deadline)
+
+
+    def missed(self):
+        return self.tardiness > 0
+
+
+    def missRate(self):
+        """ Fraction of tasks missing their deadline, 0 without deadlines
+        """
+        return float(np.mean(self.missed())) if self.count() else 0.0
+
+
+    def weightedMissRate(self):
+        """ Fraction of the priority of tasks missing their deadline
+        """
+        if self.priority is None or self.priority.sum() == 0:
+            return self.missRate()
+        return float(self.priority[self.missed()].sum() / self.priority.sum())
+
+
+    def meanTardiness(self):
+        """ Mean tardiness of the completed tasks
+        """
+        done = np.isfinite(self.tardiness)
+        return float(np.mean(self.tardiness[done])) if np.any(done) else 0.0
+
+
+    def maxTardiness(self):
+        return float(np.max(self.tardiness)) if self.count() else 0.0
+
+
+    def summary(self):
+        return {
+            'deadlines': self.count(),
+            'miss_rate': self.missRate(),
+            'weighted_miss_rate': self.weightedMissRate(),
+            'mean_tardiness': self.meanTardiness(),
+            'max_tardiness': self.maxTardiness(),
+        }
+
+
+class LogHistogram:
+
+    def __init__(self, sub_buckets=16, octaves=64):
+        """ A fixed-size histogram of non-negative values with buckets
+            growing geometrically, sub_buckets per power of two, so any
+            percentile is estimated within a relative error of about
+            2**(1/sub_buckets) - 1 in constant memory.
+        """
+        self.sub_buckets = sub_buckets
+        self.counts = np.zeros(sub_buckets * octaves + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+
+    def bucket(self, v):
+        if v < 1:
+            return 0
+        return min(int(math.log2(v) * self.sub_buckets) + 1, len(self.counts) - 1)
+
+
+    def add(self, v):
+        self.counts[self.bucket(v)] += 1
+        self.count += 1
+        self.total += v
+        self.max = v if self.max is None or v > self.max else self.max
+
+
+    def addArray(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        ind = np.zeros(values.size, dtype=int)
+        pos = values >= 1
+        ind[pos] = np.minimum((np.log2(values[pos]) * self.sub_buckets).astype(int) + 1, len(self.counts) - 1)
+        np.add.at(self.counts, ind, 1)
+        self.count += values.size
+        self.total += values.sum()
+        self.max = values.max() if self.max is None else max(self.max, values.max())
+
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+
+    def percentile(self, q):
+        """ Estimate a percentile, by the geometric middle of its bucket
+        """
+        if self.count == 0:
+            return np.nan
+        i = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        if i == 0:
+            return 0.0
+        value = 2 ** ((i - 0.5) / self.sub_buckets)
+        return min(value, self.max)
+
+
+class OnlineTaskTiming:
+
+    def __init__(self, bins=None):
+        """ Timing metrics accumulated task by task in constant memory, for
+            runs too long to keep every task. Percentiles are estimated by
+            LogHistogram.
+
+        Args:
+          bins: optional edges of embedding size classes (in unit cells)
+                to break the metrics down by
+        """
+        self.hists = {metric: LogHistogram() for metric in METRICS}
+        self.bins = None if bins is None else np.asarray(bins)
+        self.classes = None if bins is None else [OnlineTaskTiming() for _ in range(len(bins) - 1)]
+
+
+    def add(self, task):
+        """ Account a completed task
+        """
+        self.addTiming(task.getTimeArrive(), task.getLogStartTime(), task.getLogEndTime(),
+                       embeddingSize(task.getEmbd()) if self.bins is not None else None)
+
+
+    def addTiming(self, t_arrive, t_start, t_end, size=None):
+        self.hists['ET'].add(t_end - t_start)
+        self.hists['RT'].add(t_end - t_arrive)
+        self.hists['IWT'].add(t_start - t_arrive)
+        if self.bins is not None:
+            c = int(np.digitize(size, self.bins)) - 1
+            if 0 <= c < len(self.classes):
+                self.classes[c].addTiming(t_arrive, t_start, t_end)
+
+
+    def count(self):
+        return self.hists['RT'].count
+
+    def ACET(self):
+        return self.hists['ET'].mean()
+
+    def WCET(self):
+        return self.hists['ET'].max
+
+    def ACRT(self):
+        return self.hists['RT'].mean()
+
+    def WCRT(self):
+        return self.hists['RT'].max
+
+    def ACIWT(self):
+        return self.hists['IWT'].mean()
+
+    def WCIWT(self):
+        return self.hists['IWT'].max
+
+
+    def percentiles(self, metric='RT', qs=PERCENTILES):
+        return {q: self.hists[metric].percentile(q) for q in qs}
+
+
+    def summary(self, qs=PERCENTILES):
+        summary = {'count': self.count()}
+        for metric, hist in self.hists.items():
+            summary[f'AC{metric}'] = hist.mean()
+            summary[f'WC{metric}'] = hist.max if hist.count else np.nan
+            for q, v in self.percentiles(metric, qs).items():
+                summary[f'{metric}_p{q:g}'] = v
+        return summary
+
+
+    def bySize(self, qs=PERCENTILES):
+        """ Returns:
+          A list of (size_low, size_high, summary) per non-empty class
+        """
+        return [(lo, hi, c.summary(qs)) for lo, hi, c in zip(self.bins[:-1], self.bins[1:], self.classes) if c.count()]
 
 
 def calcResourceUtilisation(insts):
@@ -34,32 +359,148 @@ def calcResourceUtilisation(insts):
     for inst in insts:
         tasks.extend(inst.getTasks())
     tasks = list(set(tasks))
-    total_reqs = sum([t.getEmbd().sum() * t.getNumSamples() * t.getAnnealTime() for t in tasks])
+    total_reqs = sum([embeddingSize(t.getEmbd()) * t.getNumSamples() * t.getAnnealTime() for t in tasks])
     period = max([inst.getTiming()[1] for inst in insts]) - min([inst.getTiming()[0] for inst in insts])
     total_res = insts[0].getDeviceCapacity() * period
     return total_reqs / total_res
 
 
+def usefulSamples(inst):
+    """ Samples of an executed instruction that its tasks still needed.
+        Samples beyond the number of reads of a task are wasted.
+
+    Returns:
+      A list of (task, copies, useful samples), one per distinct task
+    """
+    copies = {}
+    for task in inst.getTasks():
+        copies[task] = copies.get(task, 0) + 1
+    useful = []
+    for task, n in copies.items():
+        delivered = n * inst.getNumReads()
+        before = task.samples_complete - delivered
+        useful.append((task, n, min(delivered, max(0, task.getNumSamples() - before))))
+    return useful
+
+
+class UtilisationMeter:
+
+    def __init__(self, window=1000000, capacity=None):
+        """ Resource utilisation accounted instruction by instruction, as in
+            calcResourceUtilisation but without keeping the instructions.
+            Only samples a task still needs count as used, each task over
+            the part of the sampling period its samples take. Used
+            space-time is also binned into windows of simulated time.
+
+        Args:
+          window: length of a window of the time series in microseconds
+          capacity: the number of resources available, such as the total of
+                    a cluster of annealers. None takes the capacity of the
+                    device of the instructions.
+        """
+        self.window = window
+        self.used = 0
+        self.fixed_capacity = capacity is not None
+        self.capacity = capacity
+        self.t_first = None
+        self.t_last = None
+        self.windows = {}
+
+
+    def record(self, inst):
+        """ Account an executed instruction. Call it once the instruction is
+            complete, after its samples were added to its tasks.
+        """
+        t_start, t_end, t_prog, t_sample = inst.getTiming()
+        if not self.fixed_capacity:
+            self.capacity = inst.getDeviceCapacity()
+        self.t_first = t_start if self.t_first is None else min(self.t_first, t_start)
+        self.t_last = t_end if self.t_last is None else max(self.t_last, t_end)
+
+        t_sample_start = t_end - t_sample
+        for task, n, useful in usefulSamples(inst):
+            if useful > 0:
+                size = embeddingSize(task.getEmbd())
+                t_useful = useful * task.getAnnealTime()
+                self.used += size * t_useful
+                # the n copies of the task sample side by side
+                self.addWindows(size * n, t_sample_start, t_sample_start + t_useful / n)
+
+
+    def addWindows(self, size, t_start, t_end):
+        """ Spread size x (t_end - t_start) of used space-time over windows
+        """
+        w = self.window
+        first, last = int(t_start // w), int(t_end // w)
+        for i in range(first, last + 1):
+            overlap = min(t_end, (i + 1) * w) - max(t_start, i * w)
+            if overlap > 0:
+                self.windows[i] = self.windows.get(i, 0) + size * overlap
+
+
+    def utilisation(self, t_now=None):
+        """ Used over available space-time from the start of the first
+            instruction to the end of the last one, or to t_now
+        """
+        if self.t_first is None:
+            return 0.0
+        t_last = self.t_last if t_now is None else max(self.t_last, t_now)
+        return self.used / (self.capacity * (t_last - self.t_first))
+
+
+    def timeSeries(self):
+        """ Returns:
+          t: start time of every window
+          utilisation: utilisation of the device in every window
+        """
+        if not self.windows:
+            return np.zeros(0), np.zeros(0)
+        first, last = min(self.windows), max(self.windows)
+        ind = np.arange(first, last + 1)
+        used = np.array([self.windows.get(i, 0) for i in ind], dtype=float)
+        return ind * self.window, used / (self.capacity * self.window)
+
+
 class SchedulerSpeedometer:
 
-    def __init__(self):
+    def __init__(self, keep_tasks=True):
+        """ Time the calls of a scheduler. For every call the number of
+            tasks, their sizes relative to the device and the period are
+            kept. See also qamts.profiling.Profiler.
+
+        Args:
+          keep_tasks: also keep the tasks of every call, needed by getStats.
+                      Turn it off to time long runs in little memory.
+        """
+        self.keep_tasks = keep_tasks
         self.logs = []
 
     def decorate(self, func):
 
         def wrapper(tasks, annealer):
-            t_start = time.time()
+            t_start = time.perf_counter()
             ret = func(tasks, annealer)
-            t_end = time.time()
-            log = t_end - t_start, tasks.copy(), annealer
-            self.logs.append(log)
+            t_end = time.perf_counter()
+            res_size = annealer.getRes().size
+            t_sizes = np.array([t.getEmbd().size for t in tasks], dtype=np.float32) / res_size
+            kept = tasks.copy() if self.keep_tasks else None
+            self.logs.append((t_end - t_start, len(tasks), t_sizes, kept))
             return ret
     
         return wrapper
 
     def getStats(self):
-        stats = []
-        for period, tasks, annealer in self.logs:
-            t_sizes = [t.getEmbd().size / annealer.getRes().size for t in tasks]
-            stats.append((tasks, t_sizes, period))
-        return stats
+        """ Returns:
+          A list of (tasks, sizes of tasks, period in seconds), one per call
+          of the scheduler
+        """
+        if not self.keep_tasks:
+            raise ValueError('getStats needs keep_tasks, use getCallStats')
+        return [(tasks, t_sizes.tolist(), period) for period, _, t_sizes, tasks in self.logs]
+
+    def getCallStats(self):
+        """ Returns:
+          A list of (number of tasks, sizes of tasks, period in seconds),
+          one per call of the scheduler
+        """
+        return [(n_tasks, t_sizes.tolist(), period) for period, n_tasks, t_sizes, _ in self.logs]
@@ -0,0 +1,95 @@
+import json
+import time
+
+from .metrics import LogHistogram
+
+PHASES = ('dequeue', 'task', 'schedule', 'placement', 'execute')
+
+# the profiler of the running simulation, timing placements deep inside the
+# scheduling algorithms. None when profiling is disabled.
+active = None
+
+
+class Profiler:
+
+    def __init__(self):
+        """ Timings of the phases of a simulation, in nanoseconds, kept in
+            fixed-size histograms. Pass it to QAMTSimulator to profile a run.
+
+            dequeue   admitting tasks and popping the next batch of events
+            task      handling task events
+            schedule  a call of the scheduler, placements included
+            placement a placement by fitDemandWithRotateFlip or
+                      FreeRectangles.allocate, cache hits excluded
+            execute   handling instruction events
+        """
+        self.hists = {phase: LogHistogram() for phase in PHASES}
+
+
+    def __enter__(self):
+        global active
+        self.previous, active = active, self
+        return self
+
+
+    def __exit__(self, *exc):
+        global active
+        active = self.previous
+
+
+    def add(self, phase, t_ns):
+        self.hists[phase].add(t_ns)
+
+
+    def lap(self, phase, t_start):
+        """ Record the time since t_start for a phase
+
+        Returns:
+          the current perf_counter_ns, the start of the next phase
+        """
+        t = time.perf_counter_ns()
+        self.hists[phase].add(t - t_start)
+        return t
+
+
+    def call(self, phase, func, *args):
+        """ Call a function and record its time for a phase
+        """
+        t = time.perf_counter_ns()
+        ret = func(*args)
+        self.hists[phase].add(time.perf_counter_ns() - t)
+        return ret
+
+
+    def report(self):
+        """ Returns:
+          A dict of phase to a dict of count, total in ms, and mean, p50, p99
+          and max in us
+        """
+        report = {}
+        for phase, h in self.hists.items():
+            report[phase] = {
+                'count': h.count,
+                'total_ms': h.total / 1e6,
+                'mean_us': h.mean() / 1e3 if h.count else None,
+                'p50_us': h.percentile(50) / 1e3 if h.count else None,
+                'p99_us': h.percentile(99) / 1e3 if h.count else None,
+                'max_us': h.max / 1e3 if h.count else None,
+            }
+        return report
+
+
+    def export(self, path):
+        """ Write the report to a JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+    def __str__(self):
+        lines = [f'{"phase":<10}{"count":>10}{"total ms":>12}{"mean us":>10}{"p50 us":>10}{"p99 us":>10}{"max us":>10}']
+        for phase, r in self.report().items():
+            if r['count']:
+                lines.append(f'{phase:<10}{r["count"]:>10}{r["total_ms"]:>12.1f}{r["mean_us"]:>10.1f}'
+                             f'{r["p50_us"]:>10.1f}{r["p99_us"]:>10.1f}{r["max_us"]:>10.1f}')
+        return '\n'.join(lines)
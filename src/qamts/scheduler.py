@@ -1,5 +1,15 @@
+import numpy as np
+
+from .allocation import Allocation
+from .bitboard import BitBoard
+from .embedding import embeddingSize
 from .instruction import QMI
-from .scheduling_algorithms import firstFit, nextFit, randomFit
+from .scheduling_algorithms import largestFreeRectangle, nextFit, orderedFit, randomFit
+
+
+def fitOptions(cache):
+    # fit functions written without a cache argument work when none is given
+    return {} if cache is None else {'cache': cache}
 
 
 class ToyScheduler:
@@ -14,8 +24,8 @@ class ToyScheduler:
         res = annealer.getRes()
         name, demand, dur = t.getReq()
         assert demand.shape[0] <= res.shape[0] and demand.shape[1] <= res.shape[1], f'Resource requirement {demand.shape} should be smaller than the number of resources available in the processor {res.shape}.'
-        res[:demand.shape[0], :demand.shape[1]] = 1
-        sched = [(name, res, dur)]
+        alloc = Allocation((0, 0), np.ones(demand.shape, dtype=int), res.shape)
+        sched = [(name, alloc, dur)]
         inst = QMI.fromSched(sched)
         inst.setNumReads(t.getNumSamples())
 
@@ -24,25 +34,31 @@ class ToyScheduler:
 
 class StaticScheduler:
 
-    def __init__(self):
+    def __init__(self, packed=False, fit=nextFit, cache=None):
         """ Static scheduler assumes that all tasks are available at time 0.
             It maximises the resource utilisation.
+
+        Args:
+          packed: pack the resource usage into a BitBoard while scheduling,
+                  which saves memory but is slower than the dense bitmap
+          fit: the packing algorithm, nextFit, firstFit or maxRectsFit
+          cache: a PlacementCache reused across scheduling rounds, for
+                 nextFit and firstFit
         """
-        pass
+        self.packed = packed
+        self.fit = fit
+        self.cache = cache
 
     def schedule(self, tasks, annealer):
         if len(tasks) == 0:
             return []
 
         reqs = [t.getReq() for t in tasks]
-        reqs = sorted(reqs, key=lambda x: (-x[1].sum(), -x[2]))
-        scheds = nextFit(reqs, annealer.getRes())
-
-        if len(scheds) == 0:
-            return []
+        reqs = sorted(reqs, key=lambda x: (-embeddingSize(x[1]), -x[2]))
+        res = annealer.getRes()
+        scheds = self.fit(reqs, BitBoard.fromArray(res) if self.packed else res, **fitOptions(self.cache))
 
-        insts = [QMI.fromSched(scheds[0])] if scheds else []
-        return insts
+        return [QMI.fromSched(sched) for sched in scheds if sched]
 
 
 class NaiveScheduler:
@@ -65,8 +81,8 @@ class NaiveScheduler:
 
         res = annealer.getRes()
         name, demand, dur = tasks[0].getReq()
-        res[:demand.shape[0], :demand.shape[1]] = 1
-        sched = [(name, res, dur)]
+        alloc = Allocation((0, 0), np.ones(demand.shape, dtype=int), res.shape)
+        sched = [(name, alloc, dur)]
 
         inst = QMI.fromSched(sched)
 
@@ -81,13 +97,22 @@ class NaiveScheduler:
 class NextFitTaskPreemption:
 
 
-    def __init__(self):
+    def __init__(self, packed=False, fit=nextFit, cache=None):
         """ This dynamic scheduler assumes time of task arrival varies.
             It allocates resources roughly according to task priority and
             maximises resource utilisation. Every schedule it produces only
             last for a specified interval.
 
+        Args:
+          packed: pack the resource usage into a BitBoard while scheduling,
+                  which saves memory but is slower than the dense bitmap
+          fit: the packing algorithm, nextFit or maxRectsFit
+          cache: a PlacementCache reused across scheduling rounds, for
+                 nextFit
         """
+        self.packed = packed
+        self.fit = fit
+        self.cache = cache
 
 
     def schedule(self, tasks, annealer):
@@ -96,17 +121,22 @@ class NextFitTaskPreemption:
             return []
 
         res = annealer.getRes()
+        if self.packed:
+            res = BitBoard.fromArray(res)
         reqs = [t.getReq() for t in tasks]
         sched = []
         while True:
 
-            new_sched = nextFit(reqs, res, n_schedules=1)[0]
+            new_sched = self.fit(reqs, res, n_schedules=1, **fitOptions(self.cache))[0]
             if len(new_sched) == 0:
                 break
             else:
                 sched.extend(new_sched)
                 for _, alloc, _ in new_sched:
-                    res += alloc
+                    alloc.addTo(res)
+
+        if len(sched) == 0:
+            return []
 
         inst = QMI.fromSched(sched)
 
@@ -118,6 +148,100 @@ class NextFitTaskPreemption:
         return [inst]
 
 
+class IncrementalScheduler:
+
+
+    def __init__(self, base=None, threshold=0.5, fit=nextFit, cache=None):
+        """ Reuse the packing of the last instruction while the ready tasks
+            barely change. Tasks of the last instruction that are still
+            ready keep their allocations, the regions of completed tasks are
+            freed and the other ready tasks are fitted into the holes. The
+            base scheduler repacks all ready tasks when there is no last
+            instruction to start from, when nothing could be placed, or when
+            the free space is too fragmented.
+
+        Args:
+          base: the scheduler doing full repacks, NextFitTaskPreemption by
+                default
+          threshold: repack when the fragmentation of the free space, 1 -
+                     largest free rectangle / free area, is above it
+          fit: the packing algorithm placing tasks into the holes
+          cache: an optional PlacementCache of fit
+        """
+        self.base = base if base is not None else NextFitTaskPreemption(cache=cache)
+        self.threshold = threshold
+        self.fit = fit
+        self.cache = cache
+
+        self.n_incremental = 0
+        self.n_full = 0
+
+
+    def schedule(self, tasks, annealer):
+
+        if len(tasks) == 0:
+            return []
+
+        inst = self.reschedule(tasks, annealer)
+        if inst is None:
+            self.n_full += 1
+            return self.base.schedule(tasks, annealer)
+
+        self.n_incremental += 1
+        return [inst]
+
+
+    def reschedule(self, tasks, annealer):
+        """ Build an instruction from the allocations of the last one
+
+        Returns:
+          A QMI, or None if a full repack is needed
+        """
+        last = annealer.getLastInst()
+        if last is None:
+            return None
+
+        ready = dict.fromkeys(tasks)
+        sched = [(t, a, t.getSampleRemain()) for t, a in zip(last.getTasks(), last.getAllocs()) if t in ready]
+        if len(sched) == 0:
+            return None
+
+        res = annealer.getRes()
+        for _, alloc, _ in sched:
+            alloc.addTo(res)
+
+        kept = {t for t, _, _ in sched}
+        reqs = [t.getReq() for t in ready if t not in kept]
+        if reqs:
+            new_sched = self.fit(reqs, res, n_schedules=1, **fitOptions(self.cache))[0]
+            for _, alloc, _ in new_sched:
+                alloc.addTo(res)
+            sched.extend(new_sched)
+
+        if fragmentation(res) > self.threshold:
+            return None
+
+        inst = QMI.fromSched(sched)
+
+        size_sample = [(t.getEmbd().size, t.getNumSamples()) for t in inst.getTasks()]
+        _, num_samples = sorted(size_sample, key=lambda x: (-x[0], x[1]))[0]
+
+        inst.setNumReads(num_samples)
+
+        return inst
+
+
+def fragmentation(res):
+    """ Fragmentation of the free resources, 1 - the area of the largest
+        free rectangle / the free area. 0 means all free resources form one
+        rectangle.
+    """
+    free = res.size - np.count_nonzero(res)
+    if free == 0:
+        return 0.0
+    return 1 - largestFreeRectangle(res) / free
+
+
 class DynamicScheduler:
 
 
@@ -136,22 +260,191 @@ class DynamicScheduler:
 
 
     def schedule(self, tasks, annealer, priority=None):
+        """ Args:
+          priority: a non-negative priority per task, the priorities of the
+                    tasks by default, which are always positive
+        """
 
         if len(tasks) == 0:
             return []
 
-        reqs = []
-
+        if priority is None:
+            priority = [t.getPriority() for t in tasks]
         reqs = [t.getReq() for t in tasks]
         scheds = randomFit(reqs, annealer.getRes(), priority)
+        if len(scheds[0]) == 0:
+            return []
 
         inst = QMI.fromSched(scheds[0])
 
         if self.n_samples:
             num_reads = self.n_samples
         else:
-            num_reads = min(t.getNumReads() for t in inst.getTasks())
+            num_reads = min(t.getSampleRemain() for t in inst.getTasks())
 
         inst.setNumReads(num_reads)
 
-        return inst
+        return [inst]
+
+
+class TimeSliceScheduler:
+
+
+    def __init__(self, quantum=100, unit='samples', policy='round_robin', weights=None, fit=nextFit, cache=None):
+        """ Share the annealer among ready tasks in time slices. Every
+            instruction runs for one quantum, after which the ready tasks
+            are packed again in the order of the policy, so a task may be
+            preempted before it has all its samples.
+
+            A small quantum gives short response times at the cost of
+            programming the annealer more often. Sweep the quantum to find
+            the best trade-off for a workload, e.g.
+
+              Sweep(paramGrid(scheduler=['TimeSliceScheduler'],
+                              scheduler_kwargs=[{'quantum': q} for q in (50, 100, 200)]))
+
+        Args:
+          quantum: the length of a time slice
+          unit: 'samples', or 'us' for microseconds of sampling
+          policy: 'round_robin' serves the tasks served least recently
+                  first, 'fair' serves the tasks with the least resource
+                  time received per weight first
+          weights: a function of a task returning its weight for the fair
+                   policy. None gives every task weight 1, and so does a
+                   weight that is not positive.
+          fit: the packing algorithm, nextFit or firstFit
+          cache: an optional PlacementCache of fit
+        """
+        if unit not in ('samples', 'us'):
+            raise ValueError(f'Unknown unit of quantum {unit}')
+        if policy not in ('round_robin', 'fair'):
+            raise ValueError(f'Unknown time slicing policy {policy}')
+        self.quantum = quantum
+        self.unit = unit
+        self.policy = policy
+        self.weights = weights
+        self.fit = fit
+        self.cache = cache
+
+        # the round a task was last served in, or the resource time it has
+        # received per weight, by task
+        self.rounds = 0
+        self.served = {}
+
+
+    def schedule(self, tasks, annealer):
+
+        if len(tasks) == 0:
+            return []
+
+        # forget tasks that have completed
+        last = annealer.getLastInst()
+        if last is not None:
+            for t in last.getTasks():
+                if t.isComplete():
+                    self.served.pop(t, None)
+
+        order = sorted(range(len(tasks)), key=lambda i: (self.served.get(tasks[i], -1), i))
+        reqs = [tasks[i].getReq() for i in order]
+        sched = self.fit(reqs, annealer.getRes(), n_schedules=1, **fitOptions(self.cache))[0]
+        if len(sched) == 0:
+            return []
+
+        inst = QMI.fromSched(sched)
+
+        quantum = self.quantum if self.unit == 'samples' else self.quantum // inst.getAnnealTime()
+        num_reads = max(1, min(quantum, max(t.getSampleRemain() for t in inst.getTasks())))
+        inst.setNumReads(num_reads)
+
+        self.rounds += 1
+        for t in dict.fromkeys(inst.getTasks()):
+            if self.policy == 'round_robin':
+                self.served[t] = self.rounds
+            else:
+                weight = self.weights(t) if self.weights else 1
+                if not weight > 0:
+                    weight = 1
+                service = embeddingSize(t.getEmbd()) * num_reads * t.getAnnealTime()
+                self.served[t] = self.served.get(t, 0) + service / weight
+
+        return [inst]
+
+
+class EDFScheduler:
+
+
+    def __init__(self, quantum=None, packed=False, cache=None):
+        """ Earliest deadline first. The ready tasks are packed onto the
+            device in order of urgency, the earliest deadline first, then
+            the highest priority and the earliest arrival. Tasks without a
+            deadline come after all tasks with one. An instruction runs
+            until its first task completes, or for at most quantum samples,
+            so the order is revisited as tasks complete and arrive.
+
+        Args:
+          quantum: the most samples of an instruction, None for no limit
+          packed: pack the resource usage into a BitBoard while scheduling,
+                  which saves memory but is slower than the dense bitmap
+          cache: an optional PlacementCache reused across scheduling rounds
+        """
+        self.quantum = quantum
+        self.packed = packed
+        self.cache = cache
+
+
+    def urgency(self, task):
+        deadline = task.getDeadline()
+        if deadline is None:
+            return (1, 0, -task.getPriority(), task.getTimeArrive())
+        return (0, deadline, -task.getPriority(), task.getTimeArrive())
+
+
+    def schedule(self, tasks, annealer):
+
+        if len(tasks) == 0:
+            return []
+
+        res = annealer.getRes()
+        if self.packed:
+            res = BitBoard.fromArray(res)
+        reqs = [t.getReq() for t in sorted(tasks, key=self.urgency)]
+        sched = orderedFit(reqs, res, self.cache)[0]
+        if len(sched) == 0:
+            return []
+
+        inst = QMI.fromSched(sched)
+
+        num_reads = min(t.getSampleRemain() for t in inst.getTasks())
+        if self.quantum:
+            num_reads = min(num_reads, self.quantum)
+        inst.setNumReads(num_reads)
+
+        return [inst]
+
+
+class LeastLaxityScheduler(EDFScheduler):
+
+
+    def __init__(self, quantum=None, packed=False, cache=None):
+        """ Least laxity first. As EDFScheduler, but tasks are ordered by
+            their laxity, the time left to the deadline less the time to
+            sample the rest of the task, see Task.getLaxity. All tasks are
+            compared at the same time, so the order does not depend on the
+            current time and the deadline less the remaining sampling time
+            is used.
+
+        Args:
+          quantum: the most samples of an instruction, None for no limit
+          packed: pack the resource usage into a BitBoard while scheduling,
+                  which saves memory but is slower than the dense bitmap
+          cache: an optional PlacementCache reused across scheduling rounds
+        """
+        super().__init__(quantum, packed, cache)
+
+
+    def urgency(self, task):
+        deadline = task.getDeadline()
+        if deadline is None:
+            return (1, 0, -task.getPriority(), task.getTimeArrive())
+        slack = deadline - task.getSampleRemain() * task.getAnnealTime()
+        return (0, slack, -task.getPriority(), task.getTimeArrive())
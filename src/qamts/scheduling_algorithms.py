@@ -1,61 +1,80 @@
+import hashlib
+import time
+from collections import OrderedDict
+
 import numpy as np
-from scipy.signal import convolve2d
+
+from . import profiling
+from .allocation import Allocation
+from .bitboard import BitBoard
+from .embedding import embeddingInfo, embeddingSize
 
 
-def randomFit(tasks: list, resources: np.ndarray, priorities=None):
+def randomFit(tasks: list, resources: np.ndarray, priorities=None, cache=None, rng=None):
     """ Random fit with priority
 
+        Tasks are drawn at random with probabilities proportional to their
+        priorities and fitted until none fits any more. A task stays in the
+        draw after it is fitted, so it may get several allocations.
+
     Args:
       tasks: A list of tuples, in the format of (name, demand, duration)
             where demand is a 2D bitmap resource requirement, duration is
             the period the task is going to last for.
-      resources: A 2D bitmap of resource usage of the target processor.
-            1 means the resource is occupied
-      priorities: a list of positive numbers. None means equal priority.
+      resources: A 2D bitmap or a BitBoard of resource usage of the target
+            processor. 1 means the resource is occupied
+      priorities: a list of non-negative numbers. None means equal
+            priority. A task with zero priority is never drawn.
+      cache: an optional PlacementCache shared across calls
+      rng: a numpy Generator. None uses np.random.
 
     Returns:
       The schedule of tasks, in the form of
-            [[(n0,alloc0,dur0),...], [(n8,alloc8,dur8),...], ...]
+            [[(n0,alloc0,dur0),...]]
     """
 
-    taskq = tasks.copy()
-    pq = priorities.copy() if priorities else [1] * len(taskq)
-
-    cdf = [sum(pq[:i]) for i, _ in enumerate(pq, start=1)]
-    cdf = np.asarray([0] + cdf) / cdf.max()
+    if priorities is None:
+        taskq, pq = tasks.copy(), [1] * len(tasks)
+    else:
+        if any(p < 0 for p in priorities):
+            raise ValueError('Priorities must not be negative')
+        taskq = [t for t, p in zip(tasks, priorities) if p > 0]
+        pq = [p for p in priorities if p > 0]
+    rand = rng.random if rng is not None else np.random.rand
 
-    schedule = resources.copy(), []
+    res = resources.copy()
+    subset = []
 
     while taskq:
 
-        i = np.digitize(np.random.rand(), cdf) - 1
-        alloc = nextFit([taskq[i]], res, n_schedules=1)
+        cdf = np.cumsum(pq)
+        i = min(int(np.searchsorted(cdf, rand() * cdf[-1], side='right')), len(taskq) - 1)
+        name, demand, duration = taskq[i]
+        alloc = fitDemandWithRotateFlip(res, demand, cache)
 
         if alloc is None:
             # This task i can no longer fit into the schedule, remove it
             taskq.pop(i)
             pq.pop(i)
-            # Regenerate the cdf
-            cdf = [sum(pq[:i]) for i, _ in enumerate(pq, start=1)]
-            cdf = np.asarray([0] + cdf) / cdf.max()
         else:
-            schedule[0] += alloc
-            schedule[1].append(taskq[i])
+            alloc.addTo(res)
+            subset.append((name, alloc, duration))
 
-    return [schedule[1]]
+    return [subset]
 
 
-def nextFit(tasks: list, resources: np.ndarray, n_schedules=None):
+def nextFit(tasks: list, resources: np.ndarray, n_schedules=None, cache=None):
     """ Next fit
 
     Args:
       tasks: A list of tuples, in the format of (name, demand, duration)
             where demand is a 2D bitmap resource requirement, duration is
             the period the task is going to last for.
-      resources: A 2D bitmap of resource usage of the target processor.
-            1 means the resource is occupied
+      resources: A 2D bitmap or a BitBoard of resource usage of the target
+            processor. 1 means the resource is occupied
       n_schedules: only produce n schedules. This saves computation
             effort if you only want the first few schedules.
+      cache: an optional PlacementCache shared across calls
 
     Returns:
       The schedule of tasks, in the form of
@@ -71,7 +90,7 @@ def nextFit(tasks: list, resources: np.ndarray, n_schedules=None):
         ind_task = None
 
         for i, (name, demand, duration) in enumerate(taskq):
-            alloc = fitDemandWithRotateFlip(res, demand)
+            alloc = fitDemandWithRotateFlip(res, demand, cache)
             if alloc is not None:
                 # find a fit
                 ind_task = i, (name, alloc, duration)
@@ -88,22 +107,66 @@ def nextFit(tasks: list, resources: np.ndarray, n_schedules=None):
 
         if ind_task is not None:
             i, (name, alloc, duration) = ind_task 
-            res += alloc
+            alloc.addTo(res)
             subset.append((name, alloc, duration))
             taskq.pop(i)
 
     return [subset for _, subset in schedules]
 
 
-def firstFit(tasks: list, resources: np.ndarray):
+def orderedFit(tasks: list, resources: np.ndarray, cache=None):
+    """ Greedy fit in the given order onto one schedule
+
+        Every task is placed at its first fit if there is any, so tasks
+        early in the list, e.g. the most urgent, are placed first. A demand
+        larger than the free area is skipped without a search, and so is a
+        demand that failed to fit before, since the free space only shrinks.
+        The packing stops once the device is full.
+
+    Args:
+      tasks: A list of tuples, in the format of (name, demand, duration)
+            where demand is a 2D bitmap resource requirement, duration is
+            the period the task is going to last for.
+      resources: A 2D bitmap or a BitBoard of resource usage of the target
+            processor. 1 means the resource is occupied
+      cache: an optional PlacementCache shared across calls
+
+    Returns:
+      The schedule of tasks, in the form of
+            [[(n0,alloc0,dur0),...]]
+    """
+    res = resources.copy()
+    free = res.size - (res.sum() if isinstance(res, BitBoard) else int(np.count_nonzero(res)))
+    failed = set()
+    subset = []
+
+    for name, demand, duration in tasks:
+        if free == 0:
+            break
+        size = embeddingSize(demand)
+        if size > free or id(demand) in failed:
+            continue
+        alloc = fitDemandWithRotateFlip(res, demand, cache)
+        if alloc is None:
+            failed.add(id(demand))
+        else:
+            alloc.addTo(res)
+            subset.append((name, alloc, duration))
+            free -= size
+
+    return [subset]
+
+
+def firstFit(tasks: list, resources: np.ndarray, cache=None):
     """ First fit
 
     Args:
       tasks: A list of tuples, in the format of (name, demand, duration)
             where demand is a 2D bitmap resource requirement, duration is
             the period the task is going to last for.
-      resources: A 2D bitmap of resource usage of the target processor.
-            1 means the resource is occupied
+      resources: A 2D bitmap or a BitBoard of resource usage of the target
+            processor. 1 means the resource is occupied
+      cache: an optional PlacementCache shared across calls
 
     Returns:
       The schedule of tasks, in the form of
@@ -116,17 +179,17 @@ def firstFit(tasks: list, resources: np.ndarray):
     while len(taskq):
         name, demand, duration = taskq.pop(0)
         for res, subset in schedules:
-            alloc = fitDemandWithRotateFlip(res, demand)
+            alloc = fitDemandWithRotateFlip(res, demand, cache)
             if alloc is not None:
-                res += alloc
+                alloc.addTo(res)
                 subset.append((name, alloc, duration))
                 break
         else:
             res = resources.copy()
             subset = []
-            alloc = fitDemandWithRotateFlip(res, demand)
+            alloc = fitDemandWithRotateFlip(res, demand, cache)
             if alloc is not None:
-                res += alloc
+                alloc.addTo(res)
                 subset.append((name, alloc, duration))
                 schedules.append((res, subset))
             else:
@@ -135,39 +198,369 @@ def firstFit(tasks: list, resources: np.ndarray):
     return [subset for _, subset in schedules]
 
 
-def fitDemandWithRotateFlip(res: np.ndarray, dmd: np.ndarray):
+def maxRectsFit(tasks: list, resources: np.ndarray, n_schedules=None, cache=None):
+    """ Next fit on an index of maximal free rectangles
+
+        Same as nextFit, but each schedule keeps a FreeRectangles index of
+        its free space instead of rescanning the resource usage for every
+        placement. Irregular demands occupy their bounding box.
+
+    Args:
+      tasks: A list of tuples, in the format of (name, demand, duration)
+            where demand is a 2D bitmap resource requirement, duration is
+            the period the task is going to last for.
+      resources: A 2D bitmap or a BitBoard of resource usage of the target
+            processor. 1 means the resource is occupied
+      n_schedules: only produce n schedules. This saves computation
+            effort if you only want the first few schedules.
+      cache: accepted for the same signature as nextFit and ignored, the
+            FreeRectangles index replaces a PlacementCache
+
+    Returns:
+      The schedule of tasks, in the form of
+            [[(n0,alloc0,dur0),...], [(n8,alloc8,dur8),...], ...]
+
+    """
+    taskq = tasks.copy()
+    empty = FreeRectangles(resources.shape, resources)
+    schedules = [(empty.copy(), [])]
+
+    while len(taskq):
+
+        space, subset = schedules[-1]
+        ind_task = None
+
+        for i, (name, demand, duration) in enumerate(taskq):
+            alloc = space.allocate(demand)
+            if alloc is not None:
+                # find a fit
+                ind_task = i, (name, alloc, duration)
+                break
+        else:
+            # not enough space, add another schedule
+            if n_schedules and len(schedules) >= n_schedules:
+                break
+            else:
+                schedules.append((empty.copy(), []))
+
+        if len(subset) == 0 and ind_task is None:
+            raise ValueError(f'Failed to fit remaining tasks {taskq}')
+
+        if ind_task is not None:
+            i, (name, alloc, duration) = ind_task
+            subset.append((name, alloc, duration))
+            taskq.pop(i)
+
+    return [subset for _, subset in schedules]
+
+
+class FreeRectangles:
+
+    def __init__(self, shape, res=None):
+        """ An index of the free space of a device, kept as a list of
+            maximal free rectangles (row, col, height, width). It is built
+            from the resource usage in one pass over the device, then
+            allocating and releasing update the list incrementally, so the
+            cost of a placement grows with the number of free rectangles
+            rather than with the area of the device.
+
+        Args:
+          shape: (rows, cols) of the device
+          res: an optional 2D bitmap or BitBoard of resource usage.
+               1 means occupied.
+        """
+        self.shape = tuple(shape)
+        if res is None:
+            self.used = np.zeros(self.shape, dtype=bool)
+            self.free = [(0, 0) + self.shape]
+        else:
+            res = res.toArray() if isinstance(res, BitBoard) else np.asarray(res)
+            self.used = res != 0
+            self.free = maximalRectangles(self.used)
+
+
+    def __repr__(self):
+        return f'FreeRectangles({self.shape}, {self.free})'
+
+
+    def copy(self):
+        space = FreeRectangles(self.shape)
+        space.used = self.used.copy()
+        space.free = self.free.copy()
+        return space
+
+
+    def fit(self, dmd):
+        """ Find a free rectangle for the bounding box of the demand, with
+            the best short side fit heuristic.
+
+        Args:
+          dmd: a 2D bitmap of demand. 1 means required.
+
+        Returns:
+          (row, col, dmd) where dmd is the demand rotated to fit at
+          (row, col), or None if the demand does not fit.
+        """
+        orients = [dmd]
+        dmdt = np.rot90(dmd)
+        if dmdt.shape != dmd.shape or not np.array_equal(dmdt, dmd):
+            orients.append(dmdt)
+
+        best = None
+        for d in orients:
+            h, w = d.shape
+            for fr, fc, fh, fw in self.free:
+                if fh >= h and fw >= w:
+                    key = min(fh - h, fw - w), max(fh - h, fw - w), fr, fc
+                    if best is None or key < best[0]:
+                        best = key, (fr, fc, d)
+
+        return best[1] if best else None
+
+
+    def allocate(self, dmd):
+        """ Fit the demand and mark its bounding box as occupied
+
+        Returns:
+          alloc: an Allocation of the demand, None if not fit
+        """
+        if profiling.active is not None:
+            fit = profiling.active.call('placement', self.fit, dmd)
+        else:
+            fit = self.fit(dmd)
+        if fit is None:
+            return None
+
+        r, c, d = fit
+        self.occupy(r, c, *d.shape)
+        return Allocation((r, c), d, self.shape)
+
+
+    def occupy(self, r, c, h, w):
+        """ Remove the rectangle (r, c, h, w) from the free space
+        """
+        self.used[r:r+h, c:c+w] = True
+        kept, parts = [], []
+        for fr, fc, fh, fw in self.free:
+            if r >= fr+fh or r+h <= fr or c >= fc+fw or c+w <= fc:
+                kept.append((fr, fc, fh, fw))
+                continue
+            # split the intersected free rectangle into its maximal parts
+            if r > fr:
+                parts.append((fr, fc, r-fr, fw))
+            if r+h < fr+fh:
+                parts.append((r+h, fc, fr+fh-r-h, fw))
+            if c > fc:
+                parts.append((fr, fc, fh, c-fc))
+            if c+w < fc+fw:
+                parts.append((fr, c+w, fh, fc+fw-c-w))
+
+        # a kept rectangle is still maximal, only the parts may be contained
+        # by another rectangle
+        parts = sorted(set(parts), key=lambda x: -x[2]*x[3])
+        new = []
+        for f in parts:
+            if not any(rectContains(g, f) for g in new) and not any(rectContains(g, f) for g in kept):
+                new.append(f)
+        self.free = kept + new
+
+
+    def release(self, r, c, h, w):
+        """ Return the rectangle (r, c, h, w) to the free space. The maximal
+            free rectangles that did not exist before all cover a released
+            cell, they are found by a pass over the rows from r down, and
+            the old rectangles they contain are dropped.
+        """
+        self.used[r:r+h, c:c+w] = False
+        new = maximalRectangles(self.used, first_row=r, region=(r, c, h, w))
+        kept = [f for f in self.free if not any(rectContains(g, f) for g in new)]
+        self.free = kept + [g for g in new if g not in kept]
+
+
+def maximalRectangles(used, first_row=0, region=None):
+    """ The maximal free rectangles of a resource usage map, in one pass
+        over its rows. For every row as the bottom, a stack over the
+        heights of free columns yields the rectangles that cannot grow up,
+        left or right. Those that cannot grow down either are maximal.
+
+    Args:
+      used: a 2D boolean map, True means occupied
+      first_row: only find rectangles with their bottom row from here
+      region: only find rectangles intersecting (row, col, height, width)
+
+    Returns:
+      A list of (row, col, height, width)
+    """
+    rows, cols = used.shape
+    heights = np.zeros(cols, dtype=int)
+    if first_row > 0:
+        # free cells directly above first_row, counted up to a used cell
+        above = used[:first_row][::-1]
+        blocked = np.where(above.any(axis=0), above.argmax(axis=0), first_row)
+        heights[:] = blocked
+    # the number of used cells in each row before each column
+    used_before = np.concatenate((np.zeros((rows, 1), dtype=int), np.cumsum(used, axis=1)), axis=1)
+
+    rects = []
+    for i in range(first_row, rows):
+        heights = np.where(used[i], 0, heights + 1)
+        hs = heights.tolist()
+        hs.append(0)
+        stack = []
+        for j, h in enumerate(hs):
+            start = j
+            while stack and stack[-1][1] > h:
+                s, sh = stack.pop()
+                start = s
+                # it cannot grow down if the row below has a used cell in it
+                if i + 1 < rows and used_before[i+1, j] - used_before[i+1, s] == 0:
+                    continue
+                rect = (i - sh + 1, s, sh, j - s)
+                if region is None or rectIntersects(rect, region):
+                    rects.append(rect)
+            if h > 0 and (not stack or stack[-1][1] < h):
+                stack.append((start, h))
+    return rects
+
+
+def largestFreeRectangle(res):
+    """ The area of the largest free rectangle of a resource usage map, by
+        the same pass as maximalRectangles
+    """
+    res = res.toArray() if isinstance(res, BitBoard) else np.asarray(res)
+    return max((h * w for _, _, h, w in maximalRectangles(res != 0)), default=0)
+
+
+def rectIntersects(a, b):
+    """ Check if rectangles a and b (row, col, height, width) overlap
+    """
+    return a[0] < b[0]+b[2] and b[0] < a[0]+a[2] and a[1] < b[1]+b[3] and b[1] < a[1]+a[3]
+
+
+def rectContains(a, b):
+    """ Check if rectangle a (row, col, height, width) contains rectangle b
+    """
+    return a[0] <= b[0] and a[1] <= b[1] and b[0]+b[2] <= a[0]+a[2] and b[1]+b[3] <= a[1]+a[3]
+
+
+class PlacementCache:
+
+    def __init__(self, maxsize=4096):
+        """ A bounded LRU cache of placements by fitDemandWithRotateFlip,
+            keyed by a hash of the resource usage and the demand. Schedulers
+            often pack the same ready tasks onto the same resource usage
+            round after round, which then costs a lookup.
+
+            hits and misses count lookups, miss_time is the time in seconds
+            spent computing the placements missed.
+
+        Args:
+          maxsize: the maximum number of placements kept
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.miss_time = 0.0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    @staticmethod
+    def key(res, dmd):
+        # the same bytes for a bitmap and a BitBoard of the same usage
+        if isinstance(res, BitBoard):
+            usage = b''.join(r.to_bytes((res.shape[1] + 7) // 8, 'little') for r in res.rows)
+        else:
+            usage = np.packbits(np.asarray(res) != 0, axis=1, bitorder='little').tobytes()
+        h = hashlib.blake2b(digest_size=16)
+        h.update(usage)
+        h.update(dmd.tobytes())
+        return res.shape, dmd.shape, dmd.dtype.str, h.digest()
+
+
+    def fit(self, res, dmd):
+        """ Same as fitDemandWithRotateFlip, looked up in the cache first
+        """
+        key = self.key(res, dmd)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            origin, dmdt = entry
+            return None if origin is None else place(res.shape, dmdt, origin)
+
+        self.misses += 1
+        t_start = time.perf_counter()
+        alloc = fitDemandWithRotateFlip(res, dmd)
+        self.miss_time += time.perf_counter() - t_start
+
+        self.entries[key] = (None, None) if alloc is None else (alloc.origin, alloc.dmd)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return alloc
+
+
+    def stats(self):
+        """ Returns:
+          A dict of hits, misses, hit rate, number of entries and the
+          estimated time saved in seconds, the average time of a miss times
+          the number of hits
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.entries),
+            'time_saved': self.miss_time / self.misses * self.hits if self.misses else 0.0,
+        }
+
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+        self.miss_time = 0.0
+
+
+def fitDemandWithRotateFlip(res: np.ndarray, dmd: np.ndarray, cache=None):
     """ Given resource usage and resource demand, fit demand with rotation
         and flip. Allow irregular shape demand.
 
+        All distinct orientations of the demand are scored in one batch by
+        bestFit. On a tie the earlier orientation wins.
+
     Args:
-      res: a 2D bitmap of resource usage. 1 means occupied.
+      res: a 2D bitmap or a BitBoard of resource usage. 1 means occupied.
       dmd: a 2D bitmap of demand. 1 means required.
+      cache: an optional PlacementCache to look the placement up in
 
     Returns:
-      alloc: a 2D bitmap of resouce allocation. 1 means allocated resource.
-             If fit not found, return None
+      alloc: an Allocation of the demand. If fit not found, return None
     """
 
-    best = None, 0
+    if cache is not None:
+        return cache.fit(res, dmd)
+    if profiling.active is not None:
+        return profiling.active.call('placement', fitRotateFlip, res, dmd)
+    return fitRotateFlip(res, dmd)
+
+
+def fitRotateFlip(res, dmd):
+    dmds = embeddingInfo(dmd).orientations
 
-    if np.all(dmd):
-        # a rectangle shape
-        for angle90 in [0, 1]:
-            dmdt = np.rot90(dmd,  k=angle90)
+    if isinstance(res, BitBoard):
+        best = None, 0
+        for dmdt in dmds:
             alloc, score = fitDemand(res, dmdt, return_score=True)
             if score > best[1]:
                 best = alloc, score
-    else:
-        # an irregular shape
-        for angle90 in [0, 1, 2, 3]:
-            for flip in [True, False]:
-                dmdt = np.rot90(dmd,  k=angle90)
-                dmdt = np.fliplr(dmdt) if flip else dmdt
-                alloc, score = fitDemand(res, dmdt, return_score=True)
-                if score > best[1]:
-                    best = alloc, score
+        return best[0]
 
-    return best[0]
+    k, ind, score = bestFit(res, dmds)
+    return place(res.shape, dmds[k], ind) if score > 0 else None
 
 
 def fitDemand(res: np.ndarray, dmd: np.ndarray, return_score=False):
@@ -175,36 +568,140 @@ def fitDemand(res: np.ndarray, dmd: np.ndarray, return_score=False):
         Allow irregular shape demand.
 
     Args:
-      res: a 2D bitmap of resource usage. 1 means occupied.
+      res: a 2D bitmap or a BitBoard of resource usage. 1 means occupied.
       dmd: a 2D bitmap of demand. 1 means required.
       return_score: indicate if return score
 
     Returns:
-      alloc: a 2D bitmap of resouce allocation. 1 means allocated resource
+      alloc: an Allocation of the demand, None if not fit
       score: the score of the fit, higher is better. 0 means does not fit
     """
 
-    # prepare mask
-    cross = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
-
-    # find feasible locations
-    feasible = convolve2d(res, dmd, mode='valid')
-    # padding ones to encourage edge fit
-    feasible_pad = np.pad(feasible, 1, 'constant', constant_values=1)
-    scores = convolve2d(feasible_pad, cross, mode='same')[1:-1, 1:-1]
-    scores = (1-feasible.astype(bool)) * scores
-    best_score = scores.max()
-
-    if best_score > 0:
-        ind = np.unravel_index(np.argmax(scores, axis=None), scores.shape)
-        ind0_start, ind0_end = ind[0], ind[0]+dmd.shape[0]
-        ind1_start, ind1_end = ind[1], ind[1]+dmd.shape[1]
-        alloc = np.zeros_like(res, dtype=int)
-        alloc[ind0_start:ind0_end, ind1_start:ind1_end] += dmd
+    if isinstance(res, BitBoard):
+        ind, best_score = res.fitScore(dmd)
     else:
-        alloc = None
+        _, ind, best_score = bestFit(res, [dmd])
+
+    alloc = place(res.shape, dmd, ind) if best_score > 0 else None
 
     if return_score:
         return alloc, best_score
     else:
         return alloc
+
+
+def place(shape, dmd: np.ndarray, ind):
+    """ Build the allocation of a demand placed at ind=(row, col)
+    """
+    return Allocation(ind, dmd, shape)
+
+
+def bestFit(res: np.ndarray, dmds: list):
+    """ Find the best fit among a few demands, usually the orientations of
+        one demand, scoring all of them in one pass.
+
+    Args:
+      res: a 2D bitmap of resource usage. 1 means occupied.
+      dmds: a list of 2D bitmaps of demand
+
+    Returns:
+      k: the index of the best demand
+      ind: (row, col) of the best fit
+      score: the score of the fit, higher is better. 0 means does not fit
+    """
+
+    scores = contactScores(overlapCounts(res, dmds))
+    if scores is None:
+        return 0, None, 0
+
+    best = scores.reshape(len(dmds), -1).max(axis=1)
+    k = int(np.argmax(best))
+    if best[k] == 0:
+        return k, None, 0
+
+    ind = np.unravel_index(np.argmax(scores[k], axis=None), scores[k].shape)
+    return k, ind, best[k]
+
+
+def overlapCounts(res: np.ndarray, dmds: list):
+    """ Count the occupied resources under each demand at every position the
+        demand can be placed.
+
+        Rectangles of ones are answered from one summed-area table of res,
+        costing O(1) per position. Other shapes are cross-correlated with res
+        in one batched FFT.
+
+    Args:
+      res: a 2D bitmap of resource usage. 1 means occupied.
+      dmds: a list of 2D bitmaps of demand. 1 means required.
+
+    Returns:
+      counts: a list with a 2D array of shape
+              (res_rows-dmd_rows+1, res_cols-dmd_cols+1) per demand, 0 means
+              the demand fits at that position. None if the demand is larger
+              than res.
+    """
+
+    H, W = res.shape
+    counts = [None] * len(dmds)
+    sat = None
+    irregular = []
+
+    for i, dmd in enumerate(dmds):
+        h, w = dmd.shape
+        if h > H or w > W:
+            continue
+        if np.all(dmd == 1):
+            if sat is None:
+                sat = np.zeros((H+1, W+1), dtype=int)
+                np.cumsum(np.cumsum(res, axis=0), axis=1, out=sat[1:, 1:])
+            counts[i] = sat[h:, w:] - sat[:-h, w:] - sat[h:, :-w] + sat[:-h, :-w]
+        else:
+            irregular.append(i)
+
+    if irregular:
+        # positions that fit never wrap around, so a circular correlation
+        # of the size of res is enough
+        kernels = np.zeros((len(irregular), H, W))
+        for j, i in enumerate(irregular):
+            kernels[j, :dmds[i].shape[0], :dmds[i].shape[1]] = dmds[i]
+        corr = np.fft.irfft2(np.fft.rfft2(res) * np.conj(np.fft.rfft2(kernels)), s=(H, W))
+        corr = np.rint(corr).astype(int)
+        for j, i in enumerate(irregular):
+            h, w = dmds[i].shape
+            counts[i] = corr[j, :H-h+1, :W-w+1]
+
+    return counts
+
+
+def contactScores(counts: list):
+    """ Score every feasible position by its contact with occupied positions
+        and the border of the device, which encourages edge fit.
+
+    Args:
+      counts: the output of overlapCounts
+
+    Returns:
+      scores: a 3D array with one 2D array of scores per demand, aligned at
+              the top left and padded with 0. 0 means infeasible.
+              None if no demand is smaller than the device.
+    """
+
+    shapes = [c.shape for c in counts if c is not None]
+    if not shapes:
+        return None
+
+    rows, cols = max(s[0] for s in shapes), max(s[1] for s in shapes)
+    # padding ones to encourage edge fit
+    pad = np.zeros((len(counts), rows+2, cols+2), dtype=int)
+    free = np.zeros((len(counts), rows, cols), dtype=bool)
+    for k, c in enumerate(counts):
+        if c is not None:
+            h, w = c.shape
+            pad[k, :h+2, :w+2] = 1
+            pad[k, 1:h+1, 1:w+1] = c
+            free[k, :h, :w] = c == 0
+
+    scores = pad[:, :-2, 1:-1] + pad[:, 2:, 1:-1] + pad[:, 1:-1, :-2] + pad[:, 1:-1, 2:]
+    scores[~free] = 0
+    return scores
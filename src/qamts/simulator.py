@@ -1,50 +1,169 @@
+import heapq
+import itertools
 import logging
+import time
+from collections import deque
+
+from .metrics import OnlineTaskTiming, TaskTiming, UtilisationMeter
+
+
+def fitsGrid(shape, grid):
+    """ Check if an embedding of a shape fits a grid, with the grid
+        dimensions sorted, in one of its orientations
+    """
+    short, long = sorted(shape)
+    return short <= grid[0] and long <= grid[1]
+
 
 class QAMTSimulator:
 
-    def __init__(self, tasks, annealer, scheduler, static_scheduling=False):
+    def __init__(self, tasks, annealer, scheduler, static_scheduling=False, util_window=1000000,
+                 retention='all', sink=None, profiler=None, lookahead=False, online_timing=None):
+        """ Simulate running tasks on an annealer, or on a cluster of
+            annealers behind one queue of ready tasks
+
+        Args:
+          tasks: a list of tasks, or an iterable of tasks sorted by time of
+                 arrival, such as qamts.workload.readTasks. Tasks are pulled
+                 from it only when the simulation reaches their arrival.
+          annealer: the annealer executing instructions, or a list of
+                    annealers. Ready tasks are dispatched to the annealer
+                    that has been idle the longest.
+          scheduler: the scheduler packing ready tasks into instructions
+          static_scheduling: make all tasks arrive at time 0
+          util_window: length in microseconds of the windows of the
+                       utilisation time series, see getUtilisation
+          retention: what is kept of completed tasks and instructions.
+                     'all' keeps everything, an int N keeps the last N,
+                     'metrics' keeps only the aggregated metrics, see
+                     getTaskTiming and getUtilisation. Tasks no longer
+                     kept drop their activity logs.
+          sink: an optional writer of completed tasks and instructions,
+                such as qamts.trace.JSONLinesSink, to keep a full trace on
+                disk whatever the retention
+          profiler: an optional qamts.profiling.Profiler recording the time
+                    of every phase of the simulation
+          lookahead: keep all the instructions a scheduler returns in the
+                     instruction queue and dispatch from it, calling the
+                     scheduler again only when the queue is empty or a new
+                     task has arrived
+          online_timing: accumulate task timing metrics, per annealer and
+                         in total, as tasks complete, see getTaskTiming.
+                         None turns it on only when completed tasks are
+                         not all retained, otherwise the metrics are
+                         computed from the retained tasks when asked for.
+        """
 
         self.logger = logging.getLogger(__name__)
 
-        self.annealer = annealer
+        self.annealers = list(annealer) if isinstance(annealer, (list, tuple)) else [annealer]
+        self.annealer = self.annealers[0]
+        self.grids = [sorted(a.getRes().shape) for a in self.annealers]
+        self.mixed = len({tuple(g) for g in self.grids}) > 1
+        self.device_names = [getattr(a, 'name', None) or f'annealer{i}' for i, a in enumerate(self.annealers)]
         self.scheduler = scheduler
+        self.static_scheduling = static_scheduling
 
         self.time = 0
-        self.event_queue = []
-
-        if static_scheduling:
-            for t in tasks:
-                t.setTimeArrive(0)
-        for t in tasks:
-            self.enqueue_event(Event.taskReady(t))
-        
-        self.task_queue = [t for t in tasks]
-        self.task_ready = []
-        self.task_run = []
-        self.task_complete = []
-
-        self.instruction_queue = []
-        self.instruction_complete = []
+        self.event_queue = EventQueue()
+
+        if isinstance(tasks, (list, tuple)) and not static_scheduling:
+            tasks = sorted(tasks, key=lambda t: t.getTimeArrive())
+        self.task_source = iter(tasks)
+        self.task_next = next(self.task_source, None)
+
+        # Tasks waiting, ready and running are kept in dicts used as ordered
+        # sets, so that moving a task between states is O(1) while the
+        # schedulers still see ready tasks in the order they became ready.
+        self.task_queue = {}
+        self.task_ready = {}
+        self.task_run = {}
+        self.lookahead = lookahead
+        self.instruction_queue = deque()
+
+        if retention == 'all':
+            maxlen = None
+        elif retention == 'metrics':
+            maxlen = 0
+        elif isinstance(retention, int) and not isinstance(retention, bool) and retention >= 0:
+            maxlen = retention
+        else:
+            raise ValueError(f'Unknown retention {retention!r}')
+        self.retention = retention
+        self.task_complete = [] if maxlen is None else deque(maxlen=maxlen)
+        self.instruction_complete = [] if maxlen is None else deque(maxlen=maxlen)
+        self.sink = sink
+
+        if online_timing is None:
+            online_timing = retention != 'all'
+        self.timing = OnlineTaskTiming() if online_timing else None
+        self.profiler = profiler
+        capacity = sum(a.getRes().size for a in self.annealers)
+        self.utilisation = UtilisationMeter(window=util_window, capacity=capacity)
+
+        # the annealer running each instruction, the time each annealer
+        # became idle, and the metrics of each annealer
+        self.inst_device = {}
+        self.task_device = {}
+        self.t_idle = [0] * len(self.annealers)
+        self.device_timing = [OnlineTaskTiming() for _ in self.annealers] if online_timing else None
+        self.device_tasks = [0] * len(self.annealers)
+        self.device_utilisation = [UtilisationMeter(window=util_window) for _ in self.annealers]
+        self.device_insts = [0] * len(self.annealers)
+        self.device_busy = [0] * len(self.annealers)
+        # the end of the busy time counted so far, instructions of a
+        # pipelined annealer overlap
+        self.device_busy_end = [0] * len(self.annealers)
+        self.device_program = [0] * len(self.annealers)
 
 
     def dequeue_event(self):
-        t = self.event_queue[0].time
-        events = [e for e in self.event_queue if e.time == t]
-        self.event_queue = [e for e in self.event_queue if e.time > t]
-        return t, events
+        return self.event_queue.pop()
 
 
     def enqueue_event(self, e):
         if e.time is None:
             e.time = self.time
-        self.event_queue.insert(0, e)
-        self.event_queue = sorted(self.event_queue, key=lambda x: x.time)
+        self.event_queue.push(e)
 
 
     def isComplete(self):
         """ Check if all tasks are complete
         """
-        return len(self.event_queue)==0
+        return len(self.event_queue)==0 and self.task_next is None
+
+
+    def admitTasks(self):
+        """ Pull tasks from the task source up to the time of the next
+            event, and enqueue their TASK_READY events
+        """
+        t_next = self.event_queue.peekTime()
+        while self.task_next is not None:
+            task = self.task_next
+            if self.static_scheduling:
+                task.setTimeArrive(0)
+            t_arrive = task.getTimeArrive()
+            if t_next is not None and t_arrive > t_next:
+                break
+
+            self.task_queue[task] = None
+            self.enqueue_event(Event.taskReady(task))
+            t_next = t_arrive
+
+            self.task_next = next(self.task_source, None)
+            if self.task_next is not None and not self.static_scheduling and self.task_next.getTimeArrive() < t_arrive:
+                raise ValueError(f'Task {self.task_next} arrives before {task}, tasks must be sorted by time of arrival')
+
+
+    def retain(self, history, item, release=None):
+        """ Append a completed task or instruction to its history, which
+            forgets the oldest one once it is full
+        """
+        if isinstance(history, deque) and len(history) == history.maxlen:
+            dropped = history[0] if history else item
+            if release is not None:
+                release(dropped)
+        history.append(item)
 
 
     def getTime(self):
@@ -58,7 +177,7 @@ class QAMTSimulator:
 
 
     def dequeueInstruction(self):
-        inst = self.instruction_queue.pop(0)
+        inst = self.instruction_queue.popleft()
         tasks = inst.getTasks()
         self.logger.info(f'Dequeue instruction for {tasks}', extra={'sim_time': self.time})
         return inst
@@ -68,16 +187,28 @@ class QAMTSimulator:
         if e.type == Event.TASK_READY:
             # put task into ready list
             task = e.data
-            self.task_queue.remove(task) 
-            self.task_ready.append(task)
+            del self.task_queue[task]
+            if self.mixed and not any(fitsGrid(task.getEmbd().shape, g) for g in self.grids):
+                raise ValueError(f'{task} does not fit any annealer')
+            self.task_ready[task] = None
+            if self.instruction_queue:
+                # the planned instructions do not include the new task
+                self.instruction_queue.clear()
             self.logger.info(f'{task} is ready', extra={'sim_time': self.time})
 
         elif e.type == Event.TASK_RUN:
             pass
         else: # e.type == Event.TASK_COMP
             task = e.data
-            self.task_ready.remove(task) 
-            self.task_complete.append(task)
+            del self.task_ready[task]
+            device = self.task_device.pop(task)
+            self.device_tasks[device] += 1
+            if self.timing is not None:
+                self.timing.add(task)
+                self.device_timing[device].add(task)
+            if self.sink is not None:
+                self.sink.writeTask(task)
+            self.retain(self.task_complete, task, lambda t: t.clearLogs())
             self.logger.info(f'{task} is complete', extra={'sim_time': self.time})
 
 
@@ -86,60 +217,277 @@ class QAMTSimulator:
             inst = e.data
 
             tasks = inst.getTasks()
-            for t in list(set(tasks)):
-                self.task_run.append(t)
-                self.task_ready.remove(t)
+            for t in dict.fromkeys(tasks):
+                self.task_run[t] = None
+                del self.task_ready[t]
             self.logger.info(f'Execute instruction for {tasks}', extra={'sim_time': self.time})
-            finish_time = self.annealer.execute(inst, self.time)
+            annealer = self.annealers[self.inst_device.setdefault(inst, 0)]
+            finish_time = annealer.execute(inst, self.time)
 
-            self.annealer.setBusy()
+            annealer.setBusy()
             self.enqueue_event(Event.instComp(inst, finish_time))
+            if getattr(annealer, 'pipelined', False):
+                # the annealer takes the next instruction once this one
+                # starts sampling
+                self.enqueue_event(Event.instRun(inst, finish_time - inst.getTiming()[3]))
         elif e.type == Event.INST_RUN:
-            pass
+            device = self.inst_device[e.data]
+            self.annealers[device].setIdle()
+            self.t_idle[device] = self.time
         else: # e.type == Event.INST_COMP
 
             inst = e.data
-            self.instruction_complete.append(inst)
+            device = self.inst_device.pop(inst)
+            self.utilisation.record(inst)
+            self.device_utilisation[device].record(inst)
+            self.device_insts[device] += 1
+            t_start, t_end, t_prog, _ = inst.getTiming()
+            self.device_busy[device] += max(0, t_end - max(t_start, self.device_busy_end[device]))
+            self.device_busy_end[device] = max(t_end, self.device_busy_end[device])
+            self.device_program[device] += t_prog
+            if self.sink is not None:
+                self.sink.writeInstruction(inst)
+            self.retain(self.instruction_complete, inst)
             tasks = inst.getTasks()
-            for t in list(set(tasks)):
-                self.task_run.remove(t)
-                self.task_ready.append(t)
+            for t in dict.fromkeys(tasks):
+                del self.task_run[t]
+                self.task_ready[t] = None
             self.logger.info(f'Log instruction for {tasks}', extra={'sim_time': self.time})
 
-            self.annealer.setIdle()
-            for task in self.task_ready:
+            if not getattr(self.annealers[device], 'pipelined', False):
+                self.annealers[device].setIdle()
+                self.t_idle[device] = self.time
+            # only tasks of this instruction have received new samples
+            for task in dict.fromkeys(tasks):
                 if task.isComplete():
+                    self.task_device[task] = device
                     self.enqueue_event(Event.taskComp(task))
 
 
+    def dispatch(self):
+        """ Schedule ready tasks onto the idle annealers, the one idle for
+            the longest first, and execute the instructions
+        """
+        if len(self.annealers) == 1:
+            idle = [0] if self.annealer.isIdle() else []
+        else:
+            idle = sorted((i for i, a in enumerate(self.annealers) if a.isIdle()), key=lambda i: self.t_idle[i])
+
+        for i in idle:
+            if not self.task_ready:
+                break
+            inst = self.nextInstruction(self.annealers[i])
+            if inst is not None:
+                self.inst_device[inst] = i
+                self.handleInstEvent(Event.instReady(inst, self.time))
+
+
+    def nextInstruction(self, annealer):
+        """ The next instruction for an annealer, from the instruction queue
+            if it is still valid, otherwise from the scheduler
+        """
+        if self.instruction_queue:
+            inst = self.instruction_queue[0]
+            if inst.getAllocs()[0].shape == annealer.getRes().shape and all(t in self.task_ready for t in inst.tasks):
+                return self.dequeueInstruction()
+            self.instruction_queue.clear()
+
+        tasks = list(self.task_ready)
+        if self.mixed:
+            # offer only the tasks that fit the grid of this annealer
+            shape = sorted(annealer.getRes().shape)
+            tasks = [t for t in tasks if fitsGrid(t.getEmbd().shape, shape)]
+            if not tasks:
+                return None
+
+        if self.profiler is not None:
+            insts = self.profiler.call('schedule', self.scheduler.schedule, tasks, annealer)
+        else:
+            insts = self.scheduler.schedule(tasks, annealer)
+        if not insts:
+            return None
+        if self.lookahead:
+            self.enqueueInstructions(insts[1:])
+        return insts[0]
+
+
     def run(self):
         """ Run the simulation
         """
 
+        prof = self.profiler
+        if prof is not None:
+            with prof:
+                self.loop(prof)
+        else:
+            self.loop(None)
+
+
+    def loop(self, prof):
+
         while not self.isComplete():
 
+            if prof is not None:
+                t = time.perf_counter_ns()
+
+            self.admitTasks()
             self.time, events = self.dequeue_event()
 
+            if prof is not None:
+                t = prof.lap('dequeue', t)
+
             # task related events
             task_events = [e for e in events if e.isTaskEvent()]
             for e in task_events:
                 self.handleTaskEvent(e)
 
-            # generate and issue inst if annealer is idle
-            if self.task_ready and self.annealer.isIdle():
-                insts = self.scheduler.schedule(self.task_ready, self.annealer)
-                events.append(Event.instReady(insts[0], self.time))
-            
+            if prof is not None:
+                t = prof.lap('task', t)
+
+            # generate and issue insts to idle annealers, the scheduler
+            # is timed by dispatch
+            if self.task_ready:
+                self.dispatch()
+
+                if prof is not None:
+                    t = time.perf_counter_ns()
+
             # instruction related events
             inst_events = [e for e in events if e.isInstEvent()]
             for e in inst_events:
                 self.handleInstEvent(e)
 
-            # print(self.time, self.event_queue)
+            # annealers freed without completing any task are given work
+            # now, as no task event at this time will trigger it. This also
+            # applies to a single annealer, which used to idle until the
+            # next event. An instruction that completes a task is not
+            # affected, the task event dispatches as before.
+            if self.task_ready and self.event_queue.peekTime() != self.time:
+                if prof is not None:
+                    t_dispatch = time.perf_counter_ns()
+                self.dispatch()
+                if prof is not None:
+                    # the scheduler is timed by dispatch, not as execute
+                    t += time.perf_counter_ns() - t_dispatch
+
+            if prof is not None:
+                prof.lap('execute', t)
 
 
     def getInstructionComplete(self):
-        return self.instruction_complete.copy()
+        return list(self.instruction_complete)
+
+
+    def getTaskComplete(self):
+        return list(self.task_complete)
+
+
+    def getTaskTiming(self):
+        """ Timing metrics of all completed tasks, whatever the retention
+
+        Returns:
+          OnlineTaskTiming with online_timing, otherwise TaskTiming of the
+          retained tasks
+        """
+        if self.timing is not None:
+            return self.timing
+        if self.retention != 'all':
+            raise ValueError('Completed tasks are not all retained, turn on online_timing for their metrics')
+        return TaskTiming(self.task_complete)
+
+
+    def getUtilisation(self):
+        """ Resource utilisation of the instructions complete so far, the
+            same as calcResourceUtilisation(getInstructionComplete()) once
+            all tasks are complete
+        """
+        return self.utilisation.utilisation()
+
+
+    def getDeviceMetrics(self):
+        """ Metrics of every annealer and of the whole cluster. Tasks are
+            accounted to the annealer that completed them.
+
+        Returns:
+          A dict of annealer name, and 'cluster', to a dict of the numbers
+          of instructions and tasks, throughput in tasks per second, the
+          busy fraction of time, the fraction of busy time spent
+          programming, the resource utilisation, and the task timing
+          summary. Annealers only have the timing summary with
+          online_timing.
+        """
+        span = self.time / 1e6
+        metrics = {}
+        for i, name in enumerate(self.device_names):
+            metrics[name] = {
+                'instructions': self.device_insts[i],
+                'tasks': self.device_tasks[i],
+                'throughput': self.device_tasks[i] / span if span else 0.0,
+                'busy': self.device_busy[i] / self.time if self.time else 0.0,
+                'programming': self.device_program[i] / self.device_busy[i] if self.device_busy[i] else 0.0,
+                'utilisation': self.device_utilisation[i].utilisation(),
+            }
+            if self.device_timing is not None:
+                metrics[name].update(self.device_timing[i].summary())
+        metrics['cluster'] = {
+            'instructions': sum(self.device_insts),
+            'tasks': sum(self.device_tasks),
+            'throughput': sum(self.device_tasks) / span if span else 0.0,
+            'busy': sum(self.device_busy) / self.time / len(self.annealers) if self.time else 0.0,
+            'programming': sum(self.device_program) / sum(self.device_busy) if sum(self.device_busy) else 0.0,
+            'utilisation': self.utilisation.utilisation(),
+            **self.getTaskTiming().summary(),
+        }
+        return metrics
+
+
+    def getUtilisationSeries(self):
+        """ Utilisation per window of simulated time, see
+            UtilisationMeter.timeSeries
+        """
+        return self.utilisation.timeSeries()
+
+
+class EventQueue:
+
+    def __init__(self):
+        """ A priority queue of events keyed on time. Events that share the
+            same time are popped together as a batch, most recently pushed
+            first, which is the order the simulator has always used.
+        """
+        self.heap = []
+        self.counter = itertools.count()
+
+
+    def __len__(self):
+        return len(self.heap)
+
+
+    def __repr__(self):
+        return repr([e for _, _, e in sorted(self.heap)])
+
+
+    def push(self, e):
+        heapq.heappush(self.heap, (e.time, -next(self.counter), e))
+
+
+    def peekTime(self):
+        return self.heap[0][0] if self.heap else None
+
+
+    def pop(self):
+        """ Pop all events of the earliest time
+
+        Returns:
+          t: the time of the events
+          events: a list of events happening at t
+        """
+        heap = self.heap
+        t, _, e = heapq.heappop(heap)
+        events = [e]
+        while heap and heap[0][0] == t:
+            events.append(heapq.heappop(heap)[2])
+        return t, events
 
 
 class Event:
@@ -186,6 +534,14 @@ class Event:
         return e
 
 
+    @staticmethod
+    def instRun(inst, time=None):
+        e = Event(time, 
+                  Event.INST_RUN,
+                  inst)
+        return e
+
+
     @staticmethod
     def instComp(inst, time=None):
         e = Event(time, 
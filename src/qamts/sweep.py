@@ -0,0 +1,211 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import embedding
+from . import scheduler as schedulers
+from .annealer import Chimera
+from .metrics import DeadlineMetrics, TaskTiming, calcResourceUtilisation
+from .simulator import QAMTSimulator
+from .task import Task
+from .utils import randomTasks
+
+
+def paramGrid(**axes):
+    """ Expand lists of parameter values into a list of parameter dicts,
+        one per combination
+
+    Example:
+      paramGrid(scheduler=['StaticScheduler'], seed=[0, 1], num_tasks=[100])
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def paramKey(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def runSimulation(params):
+    """ Generate a workload, run one simulation and collect its metrics.
+        This is what a sweep runs in every worker process.
+
+    Args:
+      params: a dict with the keys
+        scheduler: name of a scheduler class in qamts.scheduler
+        scheduler_kwargs: keyword arguments of the scheduler, default {}
+        num_tasks: number of tasks generated by randomTasks, default 100
+        seed: seed of randomTasks, default 0
+        device: (rows, cols) of the Chimera annealer, default (16, 16)
+        embd_size: the largest embedding, default (12, 12)
+        anneal_time: anneal time of tasks, default 100
+        static_scheduling: default False
+        deadline: deadline of tasks relative to their sampling time, see
+                  randomTasks, default None
+
+    Returns:
+      A dict of the parameters followed by the metrics of the run
+    """
+    p = dict(params)
+    t_start = time.perf_counter()
+
+    tasks = Task.load(randomTasks(
+        p.get('num_tasks', 100),
+        embd_size=tuple(p.get('embd_size', (12, 12))),
+        anneal_time=p.get('anneal_time', 100),
+        seed=p.get('seed', 0),
+        deadline=p.get('deadline'),
+    ))
+    scheduler = getattr(schedulers, p['scheduler'])(**p.get('scheduler_kwargs', {}))
+    sim = QAMTSimulator(
+        tasks,
+        Chimera(tuple(p.get('device', (16, 16)))),
+        scheduler,
+        static_scheduling=p.get('static_scheduling', False),
+    )
+    sim.run()
+
+    tt = TaskTiming(tasks)
+    insts = sim.getInstructionComplete()
+    t_program = sum(inst.getTiming()[2] for inst in insts)
+    row = dict(params)
+    row.update({
+        'ACET': tt.ACET(),
+        'WCET': tt.WCET(),
+        'ACRT': tt.ACRT(),
+        'WCRT': tt.WCRT(),
+        'ACIWT': tt.ACIWT(),
+        'WCIWT': tt.WCIWT(),
+        'utilisation': calcResourceUtilisation(insts),
+        'num_instructions': len(insts),
+        'programming_time': t_program,
+        'programming_overhead': t_program / sim.getTime() if sim.getTime() else 0.0,
+        'sim_time': sim.getTime(),
+        'wall_time': time.perf_counter() - t_start,
+    })
+    if p.get('deadline') is not None:
+        row.update(DeadlineMetrics(tasks).summary())
+
+    # a worker runs many simulations, do not keep the embeddings of this one
+    embedding.cache.clear()
+    return {k: v.item() if hasattr(v, 'item') else v for k, v in row.items()}
+
+
+class Sweep:
+
+    def __init__(self, grid, path=None, max_workers=None, func=runSimulation):
+        """ Run independent simulations over a parameter grid in a process
+            pool. Every result is appended to a JSON Lines file as soon as
+            it arrives, and a sweep restarted on the same file skips the
+            parameters already done.
+
+        Args:
+          grid: a list of parameter dicts, see paramGrid and runSimulation
+          path: the JSON Lines file of results. None keeps results in memory
+          max_workers: number of processes, None for one per CPU. 0 runs the
+                       simulations in this process.
+          func: the function run for every parameter dict, it must be
+                picklable and return a dict
+        """
+        self.grid = grid
+        self.path = path
+        self.max_workers = max_workers
+        self.func = func
+
+
+    def load(self):
+        """ Read the results already in the results file. A partial last
+            line, left by a sweep killed while writing, is dropped from the
+            file so its simulation runs again.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            lines = f.readlines()
+        rows = [json.loads(line) for line in lines[:-1] if line.strip()]
+        if lines and lines[-1].strip():
+            try:
+                rows.append(json.loads(lines[-1]))
+            except json.JSONDecodeError:
+                with open(self.path, 'w') as f:
+                    f.writelines(lines[:-1])
+            else:
+                if not lines[-1].endswith('\n'):
+                    # end the line, so the next result does not join it
+                    with open(self.path, 'a') as f:
+                        f.write('\n')
+        return rows
+
+
+    def pending(self, rows):
+        names = {k for params in self.grid for k in params}
+        done = {paramKey({k: v for k, v in row.items() if k in names}) for row in rows}
+        return [params for params in self.grid if paramKey(params) not in done]
+
+
+    def run(self):
+        """ Run the simulations not done yet
+
+        Returns:
+          A list of result dicts, one per parameter dict of the grid
+        """
+        rows = self.load()
+        todo = self.pending(rows)
+
+        out = open(self.path, 'a') if self.path else None
+        try:
+            if self.max_workers == 0:
+                for params in todo:
+                    rows.append(self.record(out, self.func(params)))
+            else:
+                with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                    futures = [pool.submit(self.func, params) for params in todo]
+                    for future in as_completed(futures):
+                        rows.append(self.record(out, future.result()))
+        finally:
+            if out:
+                out.close()
+
+        return rows
+
+
+    def record(self, out, row):
+        if out:
+            out.write(json.dumps(row) + '\n')
+            out.flush()
+        return row
+
+
+def toColumns(rows):
+    """ Turn a list of result dicts into a dict of columns, which can be
+        passed to pandas.DataFrame
+    """
+    names = list(dict.fromkeys(k for row in rows for k in row))
+    return {k: [row.get(k) for row in rows] for k in names}
+
+
+def bestParams(rows, by, metric):
+    """ Find the value of a parameter with the lowest mean of a metric,
+        e.g. the quantum of TimeSliceScheduler giving the shortest response
+        times for a workload, averaged over seeds
+
+    Example:
+      bestParams(rows, 'scheduler_kwargs', 'ACRT')
+
+    Args:
+      rows: result dicts of a sweep
+      by: the name of the parameter
+      metric: the name of the metric, lower is better
+
+    Returns:
+      best: the value of the parameter with the lowest mean
+      means: a list of (value, mean of the metric) sorted by the mean
+    """
+    groups = {}
+    for row in rows:
+        value = row.get(by)
+        groups.setdefault(paramKey(value), (value, []))[1].append(row[metric])
+    means = sorted(((value, sum(ms) / len(ms)) for value, ms in groups.values()), key=lambda x: x[1])
+    return (means[0][0] if means else None), means
@@ -1,47 +1,281 @@
 import json
 import random
+from array import array
+
 import numpy as np
 
+from .embedding import loadEmbeddings
+
+NONE = -2**63
+
+
+def toTime(value, field):
+    """ Convert a time to integer microseconds, rounding a fractional one
+    """
+    try:
+        return int(round(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{field} must be a finite number of microseconds, not {value!r}') from None
+
+
+def toCount(value, field):
+    """ Convert a count to an int, rejecting a fractional one
+    """
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{field} must be an integer, not {value!r}') from None
+    if count != value:
+        raise ValueError(f'{field} must be an integer, not {value!r}')
+    return count
+
+
+def toPriority(value):
+    """ Convert a priority to a float, rejecting one that is not positive
+    """
+    try:
+        priority = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'priority must be a positive number, not {value!r}') from None
+    if not 0 < priority < float('inf'):
+        raise ValueError(f'priority must be a positive number, not {value!r}')
+    return priority
+
+
+class TaskTable:
+
+    COLUMNS = ['t_arrive', 'num_reads', 'anneal_time', 'samples_complete', 'embd_id', 't_first', 't_last', 'deadline']
+
+    FLOAT_COLUMNS = ['priority']
+
+    def __init__(self, keep_logs=True):
+        """ A columnar store of tasks. Every numeric attribute of the tasks
+            is a column of 64-bit ints, times are in integer microseconds,
+            except priority which is a column of floats.
+            Only the first and last activity times of a task are kept in
+            columns, the full activity log is kept when keep_logs is set.
+            Times given as floats are rounded to whole microseconds,
+            num_reads must be integral.
+            A task without a deadline has deadline NONE, a deadline is
+            rounded like other times. A priority must be a positive number.
+
+            Task objects are lightweight views over one row of a table.
+
+        Args:
+          keep_logs: keep the activity logs of tasks
+        """
+        self.keep_logs = keep_logs
+
+        for c in self.COLUMNS:
+            setattr(self, c, array('q'))
+        for c in self.FLOAT_COLUMNS:
+            setattr(self, c, array('d'))
+        self.names = []
+
+        # distinct embeddings, referred to by embd_id
+        self.embds = []
+        self.embd_index = {}
+
+        # rarely used values, keyed by row
+        self.logs = {}
+        self.anneal_schedules = {}
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __getitem__(self, row):
+        return Task.view(self, row)
+
+
+    def __iter__(self):
+        return (Task.view(self, row) for row in range(len(self)))
+
+
+    def embdId(self, embd):
+        if embd is None:
+            return -1
+        i = self.embd_index.get(id(embd))
+        if i is None:
+            i = self.embd_index[id(embd)] = len(self.embds)
+            self.embds.append(embd)
+        return i
+
+
+    def append(self, embd=None, name=None, t_arrive=0, num_reads=100, anneal_time=20, anneal_schedule=None, deadline=None, priority=1):
+        """ Add a task
+
+        Returns:
+          The row of the task
+        """
+        row = len(self.names)
+        self.names.append(name or f'{random.randrange(0xffffffff)}')
+        self.t_arrive.append(toTime(t_arrive, 't_arrive'))
+        self.num_reads.append(toCount(num_reads, 'num_reads'))
+        self.anneal_time.append(toTime(anneal_time, 'anneal_time'))
+        self.samples_complete.append(0)
+        self.embd_id.append(self.embdId(embd))
+        self.t_first.append(NONE)
+        self.t_last.append(NONE)
+        self.deadline.append(NONE if deadline is None else toTime(deadline, 'deadline'))
+        self.priority.append(toPriority(priority))
+        if anneal_schedule is not None:
+            self.anneal_schedules[row] = anneal_schedule
+        return row
+
+
+    def extend(self, data):
+        """ Add many tasks given as dicts of Task keyword arguments
+
+        Returns:
+          A list of Task views of the new rows
+        """
+        start = len(self.names)
+        self.names.extend(d.get('name') or f'{random.randrange(0xffffffff)}' for d in data)
+        self.t_arrive.extend(toTime(d.get('t_arrive', 0), 't_arrive') for d in data)
+        self.num_reads.extend(toCount(d.get('num_reads', 100), 'num_reads') for d in data)
+        self.anneal_time.extend(toTime(d.get('anneal_time', 20), 'anneal_time') for d in data)
+        self.samples_complete.extend([0] * len(data))
+        self.embd_id.extend(self.embdId(d.get('embd')) for d in data)
+        self.t_first.extend([NONE] * len(data))
+        self.t_last.extend([NONE] * len(data))
+        self.deadline.extend(NONE if d.get('deadline') is None else toTime(d['deadline'], 'deadline') for d in data)
+        self.priority.extend(toPriority(d.get('priority', 1)) for d in data)
+        for row, d in enumerate(data, start=start):
+            if d.get('anneal_schedule') is not None:
+                self.anneal_schedules[row] = d['anneal_schedule']
+        return [Task.view(self, row) for row in range(start, len(self.names))]
+
+
+    def column(self, name):
+        """ A copy of a column as a NumPy array. Start and end times of tasks
+            that have not run are NONE.
+        """
+        if name == 'embd_sum':
+            sums = np.array([e.sum() for e in self.embds] + [0], dtype=np.int64)
+            return sums[self.column('embd_id')]
+        col = getattr(self, name)
+        return np.frombuffer(col, dtype=np.float64 if col.typecode == 'd' else np.int64).copy()
+
+
 class Task:
 
-    def __init__(self, embd=None, name=None, t_arrive=0, num_reads=100, anneal_time=20, anneal_schedule=None, **kwargs):
-        
-        self.embd = embd
-        self.name = name or f'{random.randrange(0xffffffff)}'
-        self.num_reads = num_reads
-        self.anneal_time = anneal_time
-        self.anneal_schedule = anneal_schedule
-        
-        self.t_arrive = t_arrive
-        self.samples_complete = 0
-        self.activity_logs = []
+    __slots__ = ('table', 'row')
+
+    def __init__(self, embd=None, name=None, t_arrive=0, num_reads=100, anneal_time=20, anneal_schedule=None, deadline=None, priority=1, table=None, **kwargs):
+        """ A task. It is a view over a row of a TaskTable, a table of its
+            own unless one is given.
+
+            deadline is the absolute time in microseconds the task should
+            complete by, an int or a float rounded to whole microseconds,
+            None for no deadline. priority is a positive int or float, a
+            larger priority is more important.
+        """
+        self.table = table if table is not None else TaskTable()
+        self.row = self.table.append(embd, name, t_arrive, num_reads, anneal_time, anneal_schedule, deadline, priority)
+
+
+    @staticmethod
+    def view(table, row):
+        task = object.__new__(Task)
+        task.table = table
+        task.row = row
+        return task
 
 
     def __repr__(self):
         return self.name
 
 
+    def __eq__(self, other):
+        return isinstance(other, Task) and self.table is other.table and self.row == other.row
+
+
+    def __hash__(self):
+        return hash((id(self.table), self.row))
+
+
+    @property
+    def name(self):
+        return self.table.names[self.row]
+
+
+    @property
+    def embd(self):
+        i = self.table.embd_id[self.row]
+        return self.table.embds[i] if i >= 0 else None
+
+
+    @property
+    def num_reads(self):
+        return self.table.num_reads[self.row]
+
+
+    @property
+    def anneal_time(self):
+        return self.table.anneal_time[self.row]
+
+
+    @property
+    def anneal_schedule(self):
+        return self.table.anneal_schedules.get(self.row)
+
+
+    @property
+    def t_arrive(self):
+        return self.table.t_arrive[self.row]
+
+
+    @property
+    def deadline(self):
+        t = self.table.deadline[self.row]
+        return None if t == NONE else t
+
+
+    @property
+    def priority(self):
+        return self.table.priority[self.row]
+
+
+    @property
+    def samples_complete(self):
+        return self.table.samples_complete[self.row]
+
+
+    @property
+    def activity_logs(self):
+        return self.table.logs.get(self.row, [])
+
+
     def log(self, name, period, repeat):
-        self.activity_logs.append((name, period, repeat))
+        table, row = self.table, self.row
+        act_start, act_stop = period
+        if table.t_first[row] == NONE:
+            table.t_first[row] = act_start
+        table.t_last[row] = act_start + (act_stop - act_start) * repeat
+        if table.keep_logs:
+            table.logs.setdefault(row, []).append((name, period, repeat))
 
 
     def getLogs(self):
         return self.activity_logs.copy()
 
 
+    def clearLogs(self):
+        """ Drop the activity logs, keeping the start and end times
+        """
+        self.table.logs.pop(self.row, None)
+
+
     def getLogStartTime(self):
-        if self.activity_logs:
-            return self.activity_logs[0][1][0]
-        else:
-            return None
+        t = self.table.t_first[self.row]
+        return None if t == NONE else t
 
 
     def getLogEndTime(self):
-        if self.activity_logs:
-            name, (act_start, act_stop), rep = self.activity_logs[-1]
-            return act_start + (act_stop - act_start) * rep
-        else:
-            return None
+        t = self.table.t_last[self.row]
+        return None if t == NONE else t
 
 
     def getNumSamples(self):
@@ -65,12 +299,30 @@ class Task:
 
 
     def setTimeArrive(self, t):
-        self.t_arrive = t
+        self.table.t_arrive[self.row] = toTime(t, 't_arrive')
+
+
+    def getDeadline(self):
+        return self.deadline
+
+
+    def getPriority(self):
+        return self.priority
+
+
+    def getLaxity(self, t):
+        """ The slack of the task at time t, the time left to its deadline
+            less the time to sample the rest of it. None without a deadline.
+        """
+        deadline = self.deadline
+        if deadline is None:
+            return None
+        return deadline - t - self.getSampleRemain() * self.anneal_time
 
 
     def samplePlusOne(self, s=1):
         remain = self.getSampleRemain()
-        self.samples_complete += s
+        self.table.samples_complete[self.row] += s
         if remain > s:
             return None
         else:
@@ -86,21 +338,26 @@ class Task:
 
 
     @staticmethod
-    def load(data):
-        
-        for t in data:
-            try:
-                embd = eval(t['embd'])
-            except SyntaxError:
-                loc={}
-                exec(t['embd'], globals(), loc)
-                if 'embd' not in loc:
-                    raise ValueError(f'Invalid embedding for task {t}')
-                embd = loc['embd']
+    def load(data, trusted=False, table=None):
+        """ Create tasks from a dict or a list of dicts of keyword arguments
+            of Task, where 'embd' is a declarative spec such as
+            {'shape': [r, c]}, see qamts.embedding.decodeEmbedding.
+
+        Args:
+          data: a dict or a list of dicts
+          trusted: also accept the legacy Python source string form of
+                   'embd', which is evaluated. Off by default, only use it
+                   for data you trust
+          table: the TaskTable to add the tasks to. None creates a new one
+                 shared by the loaded tasks.
+        """
+
+        items = data if isinstance(data, list) else [data]
+        embds = loadEmbeddings([t['embd'] for t in items], trusted=trusted)
+        for t, embd in zip(items, embds):
             t['embd'] = embd
+        tasks = (table if table is not None else TaskTable()).extend(items)
         if isinstance(data, list):
-            return [Task(**d) for d in data]
+            return tasks
         else:
-            return Task(**data)
-
-        
+            return tasks[0]
@@ -0,0 +1,296 @@
+import json
+import os
+
+import numpy as np
+
+from .embedding import embeddingSize
+from .metrics import TaskTiming, usefulSamples
+
+MAGIC = b'QAMTTRC1'
+
+HEADER = np.dtype([('magic', 'S8'), ('rows', '<u4'), ('cols', '<u4')])
+
+# one record per allocation of an instruction, in the order instructions
+# complete. Timing fields repeat the timing of the instruction.
+RECORD = np.dtype([
+    ('inst', '<i8'),
+    ('task', '<i8'),
+    ('t_arrive', '<i8'),
+    ('t_start', '<i8'),
+    ('t_end', '<i8'),
+    ('t_program', '<i8'),
+    ('t_sample', '<i8'),
+    ('used', '<i8'),
+    ('num_reads', '<i4'),
+    ('size', '<i4'),
+    ('row', '<i2'),
+    ('col', '<i2'),
+    ('height', '<i2'),
+    ('width', '<i2'),
+])
+
+
+class JSONLinesSink:
+
+    def __init__(self, path):
+        """ Write completed tasks and instructions of a simulation to a JSON
+            Lines file as they complete, so that a full trace is kept without
+            holding it in memory. See the retention of QAMTSimulator.
+
+            Every line is a dict with 'type' either 'task' or 'instruction'.
+
+        Args:
+          path: the file to write, it is overwritten
+        """
+        self.path = path
+        self.file = open(path, 'w')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+    def writeTask(self, task):
+        self.write({
+            'type': 'task',
+            'name': task.name,
+            't_arrive': int(task.getTimeArrive()),
+            't_start': task.getLogStartTime(),
+            't_end': task.getLogEndTime(),
+            'num_reads': int(task.getNumSamples()),
+            'anneal_time': int(task.getAnnealTime()),
+            'embd_shape': list(task.getEmbd().shape),
+            'deadline': task.getDeadline(),
+            'priority': task.getPriority(),
+            'logs': [[name, [int(a), int(b)], int(repeat)] for name, (a, b), repeat in task.getLogs()],
+        })
+
+
+    def writeInstruction(self, inst):
+        t_start, t_end, t_prog, t_sample = inst.getTiming()
+        self.write({
+            'type': 'instruction',
+            'tasks': [t.name for t in inst.getTasks()],
+            'origins': [list(a.origin) for a in inst.getAllocs()],
+            'shapes': [list(a.dmd.shape) for a in inst.getAllocs()],
+            'num_reads': int(inst.getNumReads()),
+            'anneal_time': int(inst.getAnnealTime()),
+            't_start': int(t_start),
+            't_end': int(t_end),
+            't_program': int(t_prog),
+            't_sample': int(t_sample),
+        })
+
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+
+def readTrace(path):
+    """ Read the records of a JSON Lines trace
+
+    Returns:
+      tasks: a list of task records
+      insts: a list of instruction records
+    """
+    tasks, insts = [], []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                (tasks if record['type'] == 'task' else insts).append(record)
+    return tasks, insts
+
+
+class BinaryTraceWriter:
+
+    def __init__(self, path, names=True, buffer_size=65536):
+        """ Write completed instructions of a simulation into an append-only
+            binary trace of fixed-width records, see RECORD, to be read back
+            by TraceReader. It is a sink of QAMTSimulator.
+
+            The file starts with a 16 byte header, the magic bytes and the
+            shape of the device. Tasks are numbered in the order they first
+            appear, their names are written one per line to path + '.names'.
+
+        Args:
+          path: the file to write, it is overwritten
+          names: write the names of tasks
+          buffer_size: number of records written at a time
+        """
+        self.path = path
+        self.file = open(path, 'wb')
+        self.names = open(f'{path}.names', 'w') if names else None
+        self.buffer = np.zeros(buffer_size, dtype=RECORD)
+        self.n_buffered = 0
+        self.n_insts = 0
+        self.n_tasks = 0
+        self.task_ids = {}
+        self.shape = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        if not self.file.closed:
+            if self.shape is None:
+                self.writeHeader((0, 0))
+            self.flush()
+            self.file.close()
+        if self.names is not None and not self.names.closed:
+            self.names.close()
+
+
+    def writeHeader(self, shape):
+        self.shape = tuple(shape)
+        header = np.array([(MAGIC, shape[0], shape[1])], dtype=HEADER)
+        self.file.write(header.tobytes())
+
+
+    def flush(self):
+        self.file.write(self.buffer[:self.n_buffered].tobytes())
+        self.n_buffered = 0
+
+
+    def taskId(self, task):
+        i = self.task_ids.get(task)
+        if i is None:
+            i = self.task_ids[task] = self.n_tasks
+            self.n_tasks += 1
+            if self.names is not None:
+                self.names.write(f'{task.name}\n')
+        return i
+
+
+    def writeTask(self, task):
+        # a completed task will not appear again
+        self.task_ids.pop(task, None)
+
+
+    def writeInstruction(self, inst):
+        allocs = inst.getAllocs()
+        if self.shape is None:
+            self.writeHeader(allocs[0].shape)
+
+        t_start, t_end, t_prog, t_sample = inst.getTiming()
+        # the useful space-time of a task goes to its first allocation
+        used = {task: useful * task.getAnnealTime() for task, n, useful in usefulSamples(inst)}
+        for task, alloc in zip(inst.getTasks(), allocs):
+            size = embeddingSize(task.getEmbd())
+            self.buffer[self.n_buffered] = (
+                self.n_insts, self.taskId(task), task.getTimeArrive(),
+                t_start, t_end, t_prog, t_sample, size * used.pop(task, 0),
+                inst.getNumReads(), size, *alloc.origin, *alloc.dmd.shape,
+            )
+            self.n_buffered += 1
+            if self.n_buffered == len(self.buffer):
+                self.flush()
+        self.n_insts += 1
+
+
+class TraceReader:
+
+    def __init__(self, path):
+        """ Read a binary trace written by BinaryTraceWriter. The records are
+            memory-mapped, the metrics are computed over the columns without
+            building Python objects, so traces larger than memory work.
+        """
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != MAGIC:
+            raise ValueError(f'{path} is not a QAMTS binary trace')
+        self.shape = int(header[0]['rows']), int(header[0]['cols'])
+
+        # ignore an incomplete record at the end, of a trace being written
+        n = (os.path.getsize(path) - HEADER.itemsize) // RECORD.itemsize
+        if n > 0:
+            self.records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.itemsize, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD)
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def getDeviceCapacity(self):
+        return self.shape[0] * self.shape[1]
+
+
+    def names(self):
+        """ Names of tasks by task id, None if they were not written
+        """
+        path = f'{self.path}.names'
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().splitlines()
+
+
+    def numInstructions(self):
+        return int(self.records[-1]['inst']) + 1 if len(self.records) else 0
+
+
+    def instructionStarts(self):
+        """ Index of the first record of every instruction
+        """
+        return np.searchsorted(self.records['inst'], np.arange(self.numInstructions()))
+
+
+    def instructions(self):
+        """ The first record of every instruction, holding its timing
+        """
+        return np.asarray(self.records[self.instructionStarts()])
+
+
+    def usage(self):
+        """ Fraction of the device allocated by every instruction
+        """
+        if len(self.records) == 0:
+            return np.zeros(0)
+        return np.add.reduceat(self.records['size'].astype(np.int64), self.instructionStarts()) / self.getDeviceCapacity()
+
+
+    def utilisation(self):
+        """ The resource utilisation of the trace, as calcResourceUtilisation
+        """
+        if len(self.records) == 0:
+            return 0.0
+        period = self.records['t_end'].max() - self.records['t_start'].min()
+        return self.records['used'].sum() / (self.getDeviceCapacity() * period)
+
+
+    def taskTiming(self, chunk_size=1 << 20):
+        """ Timing metrics of the tasks in the trace
+
+        Returns:
+          TaskTiming
+        """
+        n = int(self.records['task'].max()) + 1 if len(self.records) else 0
+        t_arrive = np.zeros(n, dtype=np.int64)
+        t_start = np.full(n, np.iinfo(np.int64).max)
+        t_end = np.full(n, np.iinfo(np.int64).min)
+        sizes = np.zeros(n, dtype=np.int64)
+        for i in range(0, len(self.records), chunk_size):
+            chunk = self.records[i:i+chunk_size]
+            task = chunk['task']
+            t_arrive[task] = chunk['t_arrive']
+            sizes[task] = chunk['size']
+            np.minimum.at(t_start, task, chunk['t_start'])
+            np.maximum.at(t_end, task, chunk['t_end'])
+        return TaskTiming.fromArrays(t_arrive, t_start, t_end, sizes)
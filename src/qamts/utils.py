@@ -5,8 +5,13 @@ def randomTasks(num=1,
                 embd_size=(12,12),
                 anneal_time=2000,
                 sample_range=list(range(100, 1100, 100)),
-                seed=None):
+                seed=None,
+                deadline=None):
     """ Generate tasks in the form of list of dict
+
+    Args:
+      deadline: if given, every task gets a deadline of its arrival plus
+                deadline times its sampling time
     """
     
     if isinstance(seed, int):
@@ -34,11 +39,13 @@ def randomTasks(num=1,
     for n, _rows, _cols, r, neal, arr in zip(names, embd_rows, embd_cols, num_reads, anneal_times, t_arrives):
         task = {
             'name': n,
-            'embd': f'np.ones(({_rows},{_cols}), dtype=int)',
+            'embd': {'shape': [int(_rows), int(_cols)]},
             'num_reads': int(r),
             'anneal_time': neal,
             't_arrive': arr,
         }
+        if deadline is not None:
+            task['deadline'] = int(arr + deadline * r * neal)
         task_list.append(task)
 
     return task_list
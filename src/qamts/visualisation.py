@@ -4,6 +4,7 @@ from matplotlib import pyplot as plt
 import matplotlib.ticker as mtick
 import matplotlib.colors as mcolors
 import matplotlib.patches as mpatches
+from matplotlib.collections import PolyCollection
 
 
 # borrowed from https://medium.com/@thepyprogrammer/2d-image-convolution-with-numpy-with-a-handmade-sliding-window-view-946c4acb98b4
@@ -99,6 +100,44 @@ def plotTime(inst, labels=False, ax=None):
     return ax
 
 
+def plotTraceTime(trace, t_range=None, ax=None):
+    """ Plot time v.s. resource usage of every instruction of a binary trace,
+        as plotTime does for one instruction, without building instruction
+        objects
+
+    Args:
+      trace: a qamts.trace.TraceReader
+      t_range: optional (t_min, t_max), plot only the instructions starting
+               in it
+    """
+
+    if ax is None:
+        fig, ax = plt.subplots()
+
+    insts = trace.instructions()
+    usage = trace.usage()
+    if t_range is not None:
+        mask = (insts['t_start'] >= t_range[0]) & (insts['t_start'] < t_range[1])
+        insts, usage = insts[mask], usage[mask]
+    if len(insts) == 0:
+        return ax
+
+    def boxes(x0, x1, y):
+        # one rectangle of four corners per instruction
+        return np.stack([np.stack([x0, np.zeros_like(y)], -1), np.stack([x1, np.zeros_like(y)], -1),
+                         np.stack([x1, y], -1), np.stack([x0, y], -1)], axis=1)
+
+    t_start = insts['t_start'].astype(float)
+    t_sample_start = t_start + insts['t_program']
+    ax.add_collection(PolyCollection(boxes(t_start, t_sample_start, usage), facecolor='gray', edgecolor='k'))
+    ax.add_collection(PolyCollection(boxes(t_sample_start, insts['t_end'].astype(float), usage), facecolor='none', edgecolor='k'))
+
+    ax.set_xlim([t_start.min(), insts['t_end'].max()])
+    ax.set_ylim([0, 1])
+
+    return ax
+
+
 def findCorners(alloc):
     """ Given a bitmap of allocation, find out all corners, in the form of
         type, row id, col id. The definition of the type of corners are
@@ -238,6 +277,7 @@ def findOutline(alloc):
 def findCenter(alloc):
     """ Given an allocation find the coordinate of the geometric center
     """
+    alloc = np.asarray(alloc)
     xs, ys = np.where(alloc!=0)
     x_mean, y_mean = np.mean(xs) + 0.5, np.mean(ys) + 0.5
     return y_mean, x_mean
@@ -278,6 +318,8 @@ def plotAlloc(alloc, label=None, dist=0.1, ax=None):
     """ Given an allocation, plot its polygon
     """
 
+    alloc = np.asarray(alloc)
+
     outline = findOutline(alloc)
     outline = [shrink(o, dist) for o in outline]
     names, xs, ys = zip(*outline)
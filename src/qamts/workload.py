@@ -0,0 +1,76 @@
+import csv
+import json
+
+import numpy as np
+
+from .embedding import encodeEmbedding
+from .task import Task
+
+
+def writeTasks(path, tasks):
+    """ Write tasks in the form of list of dict, such as the output of
+        randomTasks, into a JSON Lines (NDJSON) file, one task per line.
+        Embeddings given as arrays are written as declarative specs.
+    """
+    with open(path, 'w') as f:
+        for t in tasks:
+            t = dict(t)
+            if isinstance(t.get('embd'), np.ndarray):
+                t['embd'] = encodeEmbedding(t['embd'])
+            f.write(json.dumps(t) + '\n')
+
+
+def readTasks(path, fmt=None, chunk_size=1024, trusted=False):
+    """ Stream tasks from a workload file sorted by time of arrival
+
+        Tasks are built chunk by chunk, so a trace of any length can be fed
+        to QAMTSimulator while only the tasks in flight are held in memory.
+
+    Args:
+      path: a JSON Lines (NDJSON) file with one dict of Task keyword
+            arguments per line, or a CSV file with a header naming them.
+            The 'embd' column of a CSV file holds the embedding spec as JSON.
+      fmt: 'ndjson' or 'csv'. None guesses from the file extension.
+      chunk_size: number of tasks built at a time
+      trusted: accept the legacy Python source form of embeddings
+
+    Yields:
+      Task
+    """
+    fmt = fmt or ('csv' if str(path).endswith('.csv') else 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError(f'Unknown workload format {fmt}')
+
+    with open(path, newline='') as f:
+        if fmt == 'csv':
+            rows = (parseCSVRow(row) for row in csv.DictReader(f))
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from Task.load(chunk, trusted=trusted)
+                chunk = []
+        if chunk:
+            yield from Task.load(chunk, trusted=trusted)
+
+
+def parseCSVRow(row):
+    """ Convert the fields of a CSV row to the types Task expects
+    """
+    task = {}
+    for k, v in row.items():
+        if v is None or v == '':
+            continue
+        if k == 'embd':
+            task[k] = json.loads(v) if v.lstrip().startswith('{') else v
+        elif k == 'name':
+            task[k] = v
+        else:
+            try:
+                task[k] = int(v)
+            except ValueError:
+                task[k] = float(v)
+    return task
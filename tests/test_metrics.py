@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from qamts.annealer import Chimera
+from qamts.metrics import DeadlineMetrics, OnlineTaskTiming, TaskTiming, calcResourceUtilisation
+from qamts.scheduler import NextFitTaskPreemption
+from qamts.simulator import QAMTSimulator
+from qamts.task import Task
+from qamts.utils import randomTasks
+
+
+@pytest.fixture(scope='module')
+def tasks():
+    tasks = Task.load(randomTasks(60, anneal_time=100, seed=0))
+    QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption()).run()
+    return tasks
+
+
+def test_task_timing(tasks):
+
+    tt = TaskTiming(tasks)
+    rt = [t.getLogEndTime() - t.getTimeArrive() for t in tasks]
+    et = [t.getLogEndTime() - t.getLogStartTime() for t in tasks]
+
+    assert tt.ACRT() == pytest.approx(np.mean(rt))
+    assert tt.WCET() == np.max(et)
+
+    summary = tt.summary()
+    assert summary['count'] == len(tasks)
+    assert summary['RT_p50'] == pytest.approx(np.percentile(rt, 50))
+    assert summary['WCIWT'] == tt.WCIWT()
+
+    breakdown = tt.bySize(bins=4)
+    assert sum(s['count'] for _, _, s in breakdown) == len(tasks)
+
+
+def test_online_task_timing(tasks):
+
+    tt = TaskTiming(tasks)
+    online = OnlineTaskTiming(bins=[0, 16, 64, 256])
+    for t in tasks:
+        online.add(t)
+
+    assert online.count() == len(tasks)
+    assert online.ACRT() == pytest.approx(tt.ACRT())
+    assert online.WCET() == tt.WCET()
+    rt = tt.values['RT']
+    for q, v in online.percentiles('RT').items():
+        assert v == pytest.approx(np.percentile(rt, q, method='inverted_cdf'), rel=0.05)
+    assert sum(s['count'] for _, _, s in online.bySize()) == len(tasks)
+
+
+@pytest.mark.parametrize('static', [True, False])
+def test_online_utilisation(static):
+
+    tasks = Task.load(randomTasks(60, anneal_time=100, seed=1))
+    sim = QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption(), static_scheduling=static, util_window=50000)
+    sim.run()
+
+    insts = sim.getInstructionComplete()
+    assert sim.getUtilisation() == pytest.approx(calcResourceUtilisation(insts))
+
+    t, util = sim.getUtilisationSeries()
+    assert np.all(util >= 0) and np.all(util <= 1 + 1e-9)
+    meter = sim.utilisation
+    assert (util * meter.capacity * meter.window).sum() == pytest.approx(meter.used)
+
+
+def test_deadline_metrics():
+
+    dm = DeadlineMetrics.fromArrays([10, 30, np.nan, 50], [20, 20, 40, np.nan], priority=[1, 3, 1, 1])
+    assert dm.count() == 3
+    assert dm.missRate() == pytest.approx(2 / 3)
+    assert dm.weightedMissRate() == pytest.approx(4 / 5)
+    assert dm.meanTardiness() == pytest.approx(5)
+    assert dm.maxTardiness() == np.inf
+
+    tasks = Task.load(randomTasks(30, anneal_time=100, seed=3, deadline=1e9))
+    QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption()).run()
+    assert DeadlineMetrics(tasks).summary() == {
+        'deadlines': 30, 'miss_rate': 0.0, 'weighted_miss_rate': 0.0, 'mean_tardiness': 0.0, 'max_tardiness': 0.0,
+    }
+
+
+def test_by_size_needs_sizes():
+
+    tt = TaskTiming.fromArrays([0, 0], [1, 2], [3, 4])
+    with pytest.raises(ValueError, match='sizes'):
+        tt.bySize()
+    assert len(TaskTiming.fromArrays([0, 0], [1, 2], [3, 4], [1, 2]).bySize(bins=2)) == 2
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import json
+import time
+
+import pytest
+
+from qamts import profiling
+from qamts.annealer import Chimera
+from qamts.metrics import SchedulerSpeedometer
+from qamts.profiling import Profiler
+from qamts.scheduler import NextFitTaskPreemption, StaticScheduler, TimeSliceScheduler
+from qamts.scheduling_algorithms import maxRectsFit
+from qamts.simulator import QAMTSimulator
+from qamts.task import Task
+from qamts.utils import randomTasks
+
+
+@pytest.mark.parametrize('scheduler', [NextFitTaskPreemption(), StaticScheduler(fit=maxRectsFit)])
+def test_profiler(scheduler, tmp_path):
+
+    tasks = Task.load(randomTasks(30, anneal_time=100, seed=0))
+    prof = Profiler()
+    sim = QAMTSimulator(tasks, Chimera(), scheduler, profiler=prof)
+    sim.run()
+
+    report = prof.report()
+    assert report['dequeue']['count'] == report['task']['count'] == report['execute']['count']
+    assert report['schedule']['count'] == len(sim.getInstructionComplete())
+    assert report['placement']['count'] > 0
+    assert report['schedule']['total_ms'] > 0
+    assert profiling.active is None
+
+    prof.export(tmp_path / 'profile.json')
+    with open(tmp_path / 'profile.json') as f:
+        assert json.load(f)['placement']['count'] == report['placement']['count']
+    assert 'placement' in str(prof)
+
+
+def test_scheduling_is_not_counted_as_execute():
+
+    scheduler = TimeSliceScheduler(50)
+    schedule = scheduler.schedule
+
+    def slow(tasks, annealer):
+        time.sleep(0.002)
+        return schedule(tasks, annealer)
+
+    scheduler.schedule = slow
+    prof = Profiler()
+    QAMTSimulator(Task.load(randomTasks(10, anneal_time=100, seed=0)), Chimera(), scheduler, profiler=prof).run()
+
+    # time slices end without completing tasks, so instruction events
+    # dispatch again, and that scheduling is only counted as schedule
+    report = prof.report()
+    assert report['schedule']['total_ms'] >= 2 * report['schedule']['count']
+    assert report['execute']['total_ms'] < report['schedule']['total_ms'] / 4
+
+
+def test_scheduler_speedometer():
+
+    tasks = Task.load(randomTasks(20, anneal_time=100, seed=0))
+    scheduler = NextFitTaskPreemption()
+    meter = SchedulerSpeedometer()
+    scheduler.schedule = meter.decorate(scheduler.schedule)
+    sim = QAMTSimulator(tasks, Chimera(), scheduler)
+    sim.run()
+
+    stats = meter.getCallStats()
+    assert len(stats) == len(sim.getInstructionComplete())
+    n_tasks, t_sizes, period = stats[0]
+    assert n_tasks == len(t_sizes) > 0
+    assert period >= 0
+
+    # getStats keeps its original shape, with the tasks of every call
+    tasks, sizes, period = meter.getStats()[0]
+    assert len(tasks) == n_tasks and sizes == t_sizes
+
+    light = SchedulerSpeedometer(keep_tasks=False)
+    light.decorate(NextFitTaskPreemption().schedule)(tasks, Chimera())
+    assert len(light.getCallStats()) == 1
+    with pytest.raises(ValueError):
+        light.getStats()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from scipy.signal import convolve2d
+
+from qamts.allocation import Allocation
+from qamts.bitboard import BitBoard
+from qamts.embedding import orientations
+from qamts.scheduling_algorithms import (FreeRectangles, PlacementCache, fitDemand, fitDemandWithRotateFlip, firstFit, maxRectsFit, nextFit,
+                                        largestFreeRectangle, maximalRectangles, orderedFit, randomFit, rectContains)
+
+
+def fitDemandConvolve(res, dmd):
+    """ fitDemand as it was implemented with scipy convolve2d. The demand
+        is flipped for the convolution, so irregular shapes are checked
+        for overlap as they are placed.
+    """
+    cross = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+    feasible = convolve2d(res, dmd[::-1, ::-1], mode='valid')
+    feasible_pad = np.pad(feasible, 1, 'constant', constant_values=1)
+    scores = convolve2d(feasible_pad, cross, mode='same')[1:-1, 1:-1]
+    scores = (1-feasible.astype(bool)) * scores
+    if scores.max() == 0:
+        return None, 0
+    ind = np.unravel_index(np.argmax(scores, axis=None), scores.shape)
+    alloc = np.zeros_like(res, dtype=int)
+    alloc[ind[0]:ind[0]+dmd.shape[0], ind[1]:ind[1]+dmd.shape[1]] += dmd
+    return alloc, scores.max()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fit_demand_matches_convolution(seed):
+
+    rng = np.random.default_rng(seed)
+    res = (rng.random((16, 16)) < 0.3).astype(int)
+    res[4:12, 4:12] = 0
+
+    for rows in range(1, 9):
+        for cols in range(1, 9):
+            dmd = np.ones((rows, cols), dtype=int)
+            alloc, score = fitDemand(res, dmd, return_score=True)
+            alloc_ref, score_ref = fitDemandConvolve(res, dmd)
+            assert score == score_ref
+            assert np.array_equal(alloc, alloc_ref)
+
+
+def test_fit_demand_irregular_shape():
+
+    res = np.zeros((4, 4), dtype=int)
+    res[0, 1:] = 1
+    dmd = np.array([[1, 0], [1, 1]])
+
+    alloc = fitDemand(res, dmd)
+
+    assert alloc.sum() == dmd.sum()
+    assert not np.any(alloc & res)
+
+
+def test_fit_demand_larger_than_device():
+
+    alloc, score = fitDemand(np.zeros((4, 4), dtype=int), np.ones((5, 2), dtype=int), return_score=True)
+
+    assert alloc is None and score == 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitboard_matches_bitmap(seed):
+
+    rng = np.random.default_rng(seed)
+    res = (rng.random((12, 14)) < 0.4).astype(int)
+    board = BitBoard.fromArray(res)
+    assert np.array_equal(board.toArray(), res)
+
+    for dmd in [np.ones((2, 3), dtype=int), np.array([[1, 1], [0, 1]]), np.array([[0, 1, 0], [1, 1, 1]])]:
+        alloc, score = fitDemand(res, dmd, return_score=True)
+        alloc_packed, score_packed = fitDemand(board, dmd, return_score=True)
+        assert score == score_packed
+        assert (alloc is None and alloc_packed is None) or np.array_equal(alloc, alloc_packed)
+
+    reqs = [(i, np.ones(tuple(rng.integers(1, 6, size=2)), dtype=int), 1) for i in range(10)]
+    for fit in [nextFit, firstFit]:
+        scheds = fit(reqs, np.zeros((12, 14), dtype=int))
+        scheds_packed = fit(reqs, BitBoard((12, 14)))
+        assert [[n for n, _, _ in s] for s in scheds] == [[n for n, _, _ in s] for s in scheds_packed]
+
+
+def test_free_rectangles_track_free_space():
+
+    def cover(space):
+        grid = np.zeros(space.shape, dtype=int)
+        for r, c, h, w in space.free:
+            grid[r:r+h, c:c+w] = 1
+        return grid
+
+    rng = np.random.default_rng(0)
+    res = (rng.random((10, 12)) < 0.3).astype(int)
+    space = FreeRectangles(res.shape, res)
+    assert np.array_equal(cover(space), 1 - res)
+
+    for r, c, h, w, occupied in [(0, 0, 4, 4, 1), (2, 3, 5, 6, 0), (6, 6, 4, 6, 1), (3, 0, 2, 12, 0), (0, 0, 10, 12, 1)]:
+        if occupied:
+            space.occupy(r, c, h, w)
+        else:
+            space.release(r, c, h, w)
+        res[r:r+h, c:c+w] = occupied
+        assert np.array_equal(cover(space), 1 - res)
+        # the index is the same as one built from scratch
+        assert sorted(space.free) == sorted(FreeRectangles(res.shape, res).free)
+        assert not any(a != b and rectContains(a, b) for a in space.free for b in space.free)
+
+    assert space.free == []
+    space.release(0, 0, 10, 12)
+    assert space.free == [(0, 0, 10, 12)]
+
+
+def test_maximal_rectangles_match_brute_force():
+
+    def brute(free):
+        rows, cols = free.shape
+        rects = []
+        for r in range(rows):
+            for c in range(cols):
+                for h in range(1, rows - r + 1):
+                    for w in range(1, cols - c + 1):
+                        if not free[r:r+h, c:c+w].all():
+                            continue
+                        grows = ((r > 0 and free[r-1, c:c+w].all()) or (r+h < rows and free[r+h, c:c+w].all()) or
+                                 (c > 0 and free[r:r+h, c-1].all()) or (c+w < cols and free[r:r+h, c+w].all()))
+                        if not grows:
+                            rects.append((r, c, h, w))
+        return sorted(rects)
+
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        used = rng.random((6, 8)) < rng.random()
+        assert sorted(maximalRectangles(used)) == brute(~used)
+        assert largestFreeRectangle(used.astype(int)) == max((h * w for _, _, h, w in brute(~used)), default=0)
+
+
+def test_max_rects_fit():
+
+    rng = np.random.default_rng(0)
+    reqs = [(i, np.ones(tuple(rng.integers(1, 9, size=2)), dtype=int), 1) for i in range(30)]
+
+    scheds = maxRectsFit(reqs, np.zeros((16, 16), dtype=int))
+    # it takes a cache like nextFit, so schedulers can pass one
+    cached = maxRectsFit(reqs, np.zeros((16, 16), dtype=int), cache=PlacementCache())
+    assert [[(n, a.origin) for n, a, _ in s] for s in cached] == [[(n, a.origin) for n, a, _ in s] for s in scheds]
+
+    assert sorted(n for s in scheds for n, _, _ in s) == list(range(30))
+    for s in scheds:
+        assert sum(np.asarray(alloc) for _, alloc, _ in s).max() == 1
+
+
+def test_orientations_are_distinct():
+
+    assert len(orientations(np.ones((3, 3), dtype=int))) == 1
+    assert len(orientations(np.ones((2, 3), dtype=int))) == 2
+    assert len(orientations(np.array([[1, 1], [1, 0]]))) == 4
+    assert len(orientations(np.array([[1, 1, 0], [0, 1, 1]]))) == 4
+    assert len(orientations(np.array([[1, 1, 1], [0, 1, 0]]))) == 4
+    assert len(orientations(np.array([[1, 1, 1], [0, 0, 1]]))) == 8
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batched_orientations_match_loop(seed):
+
+    rng = np.random.default_rng(seed)
+    res = (rng.random((12, 10)) < 0.3).astype(int)
+
+    for dmd in [np.ones((2, 5), dtype=int), np.array([[1, 1, 1], [0, 0, 1]]), np.array([[0, 1], [1, 1]])]:
+        # the convolution is an oracle independent of bestFit
+        best = None, 0
+        for dmdt in orientations(dmd):
+            alloc, score = fitDemandConvolve(res, dmdt)
+            if score > best[1]:
+                best = alloc, score
+
+        alloc = fitDemandWithRotateFlip(res, dmd)
+        assert (alloc is None and best[0] is None) or np.array_equal(alloc, best[0])
+        if alloc is not None:
+            assert not np.any(np.asarray(alloc) & res)
+
+
+def test_allocation_is_sparse():
+
+    res = np.zeros((8, 8), dtype=int)
+    res[:, :3] = 1
+    dmd = np.array([[1, 1], [1, 0]])
+
+    alloc = fitDemand(res, dmd)
+
+    assert isinstance(alloc, Allocation)
+    assert alloc.dmd.shape == dmd.shape and alloc.shape == res.shape
+    assert alloc.sum() == np.asarray(alloc).sum() == 3
+
+    board = BitBoard.fromArray(res)
+    alloc.addTo(board)
+    alloc.addTo(res)
+    assert np.array_equal(board.toArray(), res)
+
+
+@pytest.mark.parametrize('fit', [nextFit, firstFit])
+def test_placement_cache(fit):
+
+    rng = np.random.default_rng(0)
+    reqs = [(f't{i}', np.ones(tuple(rng.integers(1, 8, 2)), dtype=int), 10) for i in range(30)]
+    res = np.zeros((16, 16), dtype=int)
+    cache = PlacementCache(maxsize=1000)
+
+    def origins(scheds):
+        return [[(n, a.origin, a.dmd.shape) for n, a, _ in sched] for sched in scheds]
+
+    expected = origins(fit(reqs, res))
+    assert origins(fit(reqs, res, cache=cache)) == expected
+    misses = cache.misses
+
+    # the same round again is served from the cache
+    assert origins(fit(reqs, BitBoard.fromArray(res), cache=cache)) == expected
+    assert cache.misses == misses
+    assert cache.stats()['hit_rate'] > 0
+
+
+def test_placement_cache_is_bounded():
+
+    cache = PlacementCache(maxsize=3)
+    res = np.zeros((8, 8), dtype=int)
+    for h in range(1, 6):
+        cache.fit(res, np.ones((h, 1), dtype=int))
+    assert len(cache) == 3
+
+    # the least recently used entries were evicted
+    cache.fit(res, np.ones((1, 1), dtype=int))
+    assert cache.misses == 6 and cache.hits == 0
+    cache.fit(res, np.ones((5, 1), dtype=int))
+    assert cache.hits == 1
+
+
+def test_random_fit_is_seeded_and_respects_priorities():
+
+    res = np.zeros((16, 16), dtype=int)
+    reqs = [(i, np.ones((4, 4), dtype=int), 1) for i in range(4)]
+
+    a = randomFit(reqs, res, rng=np.random.default_rng(0))
+    b = randomFit(reqs, res, rng=np.random.default_rng(0))
+    assert [(n, a.origin) for n, a, _ in a[0]] == [(n, a.origin) for n, a, _ in b[0]]
+    assert len(a[0]) == 16
+
+    # a task with zero priority is never drawn, even with space left
+    sched = randomFit(reqs, res, priorities=[1, 1, 0, 1], rng=np.random.default_rng(0))[0]
+    assert len(sched) == 16 and 2 not in [n for n, _, _ in sched]
+    reqs_left = [('a', np.ones((16, 9), dtype=int), 1), ('z', np.ones((2, 2), dtype=int), 1)]
+    sched = randomFit(reqs_left, res, priorities=[1, 0], rng=np.random.default_rng(0))[0]
+    assert [n for n, _, _ in sched] == ['a']
+    assert randomFit(reqs_left, res, priorities=[0, 0])[0] == []
+    with pytest.raises(ValueError):
+        randomFit(reqs_left, res, priorities=[1, -1])
+
+    total = np.zeros_like(res)
+    for _, alloc, _ in sched:
+        alloc.addTo(total)
+    assert total.max() == 1
+
+
+def test_ordered_fit_places_in_order():
+
+    res = np.zeros((8, 8), dtype=int)
+    big, small = np.ones((8, 7), dtype=int), np.ones((2, 2), dtype=int)
+    reqs = [('a', small, 1), ('b', big, 1), ('c', big, 1), ('d', small, 1), ('e', small, 1)]
+
+    for r in (res, BitBoard.fromArray(res)):
+        sched = orderedFit(reqs, r)[0]
+        assert [n for n, _, _ in sched] == ['a', 'd', 'e']
+
+    # the head of the order wins the space
+    assert [n for n, _, _ in orderedFit(reqs[1:], res)[0]] == ['b']
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from qamts.annealer import Chimera
+from qamts.metrics import DeadlineMetrics, SchedulerSpeedometer
+from qamts.scheduler import (DynamicScheduler, EDFScheduler, IncrementalScheduler, LeastLaxityScheduler, NextFitTaskPreemption,
+                             StaticScheduler, TimeSliceScheduler)
+from qamts.simulator import Event, EventQueue, QAMTSimulator
+from qamts.task import Task, TaskTable
+from qamts.trace import JSONLinesSink, readTrace
+from qamts.utils import randomTasks
+
+
+def test_event_queue_batches_same_time_events():
+
+    queue = EventQueue()
+    for t, name in [(5, 'a'), (1, 'b'), (5, 'c'), (3, 'd'), (1, 'e')]:
+        queue.push(Event(t, Event.TASK_READY, name))
+
+    batches = []
+    while len(queue):
+        t, events = queue.pop()
+        batches.append((t, [e.data for e in events]))
+
+    # same-time events come out most recently pushed first
+    assert batches == [(1, ['e', 'b']), (3, ['d']), (5, ['c', 'a'])]
+
+
+@pytest.mark.parametrize('scheduler', [StaticScheduler, NextFitTaskPreemption, IncrementalScheduler])
+def test_all_tasks_complete(scheduler):
+
+    tasks = Task.load(randomTasks(20, anneal_time=100, seed=1))
+    sim = QAMTSimulator(tasks, Chimera(), scheduler())
+    sim.run()
+
+    assert not sim.task_queue and not sim.task_ready and not sim.task_run
+    assert sorted(sim.task_complete, key=str) == sorted(tasks, key=str)
+    assert all(t.isComplete() for t in tasks)
+
+
+@pytest.mark.parametrize('scheduler, static, expected', [
+    (StaticScheduler, True, (728000, 9, 9602000, 6752000)),
+    (StaticScheduler, False, (870000, 10, 13844000, 10974000)),
+    (NextFitTaskPreemption, True, (700000, 10, 7310000, 3930000)),
+    (NextFitTaskPreemption, False, (700000, 10, 12482000, 9256000)),
+])
+def test_single_annealer_matches_baseline(scheduler, static, expected):
+
+    # results of the original single-annealer simulator
+    tasks = Task.load(randomTasks(30, anneal_time=100, seed=12))
+    sim = QAMTSimulator(tasks, Chimera(), scheduler(), static_scheduling=static)
+    sim.run()
+
+    ends = sum(t.getLogEndTime() for t in tasks)
+    starts = sum(t.getLogStartTime() for t in tasks)
+    assert (sim.getTime(), len(sim.getInstructionComplete()), ends, starts) == expected
+
+
+@pytest.mark.parametrize('retention', ['all', 5, 'metrics'])
+def test_retention(retention, tmp_path):
+
+    full = Task.load(randomTasks(40, anneal_time=100, seed=2))
+    reference = QAMTSimulator(full, Chimera(), NextFitTaskPreemption())
+    reference.run()
+
+    tasks = Task.load(randomTasks(40, anneal_time=100, seed=2))
+    with JSONLinesSink(tmp_path / 'trace.jsonl') as sink:
+        sim = QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption(), retention=retention, sink=sink)
+        sim.run()
+    trace_tasks, trace_insts = readTrace(tmp_path / 'trace.jsonl')
+
+    n_insts = len(reference.getInstructionComplete())
+    kept = {'all': 40, 5: 5, 'metrics': 0}[retention]
+    kept_insts = {'all': n_insts, 5: 5, 'metrics': 0}[retention]
+    assert len(sim.getTaskComplete()) == kept
+    assert len(sim.getInstructionComplete()) == kept_insts
+    assert sum(1 for t in tasks if t.getLogs()) == kept
+
+    # metrics and the trace cover every task whatever is kept
+    assert sim.getTaskTiming().count() == 40
+    assert sim.getTaskTiming().WCRT() == reference.getTaskTiming().WCRT()
+    assert sim.getUtilisation() == pytest.approx(reference.getUtilisation())
+    assert len(trace_tasks) == 40 and len(trace_insts) == n_insts
+    assert {t['name']: t['t_end'] for t in trace_tasks} == {t.name: t.getLogEndTime() for t in tasks}
+
+
+@pytest.mark.parametrize('retention', ['some', -1, True, False])
+def test_unknown_retention(retention):
+
+    with pytest.raises(ValueError):
+        QAMTSimulator([], Chimera(), NextFitTaskPreemption(), retention=retention)
+
+
+def test_online_timing_is_opt_in():
+
+    def run(**kwargs):
+        sim = QAMTSimulator(Task.load(randomTasks(20, anneal_time=100, seed=4)), Chimera(), NextFitTaskPreemption(), **kwargs)
+        sim.run()
+        return sim
+
+    default, online = run(), run(online_timing=True)
+    assert default.timing is None and default.device_timing is None
+    assert default.getTaskTiming().count() == online.getTaskTiming().count() == 20
+    assert default.getTaskTiming().WCRT() == online.getTaskTiming().WCRT()
+    assert default.getDeviceMetrics()['cluster']['tasks'] == 20
+    assert 'WCRT' in online.getDeviceMetrics()['annealer0'] and 'WCRT' not in default.getDeviceMetrics()['annealer0']
+
+    # a run without completed tasks has NaN timing metrics
+    for online_timing in (False, True):
+        empty = QAMTSimulator([], Chimera(), NextFitTaskPreemption(), online_timing=online_timing).getDeviceMetrics()
+        assert empty['cluster']['tasks'] == 0 and np.isnan(empty['cluster']['WCRT'])
+
+    # metrics retention turns it on, unless told otherwise
+    assert run(retention='metrics').getTaskTiming().count() == 20
+    with pytest.raises(ValueError):
+        run(retention='metrics', online_timing=False).getTaskTiming()
+
+
+def test_incremental_scheduler_keeps_allocations():
+
+    table = TaskTable()
+    tasks = [Task(np.ones((r, c), dtype=int), num_reads=n, table=table)
+             for r, c, n in [(8, 8, 100), (8, 4, 300), (4, 4, 200), (3, 5, 100), (6, 6, 100), (2, 2, 100)]]
+    annealer = Chimera()
+    scheduler = IncrementalScheduler(threshold=1.0)
+
+    first = scheduler.schedule(tasks[:4], annealer)[0]
+    annealer.execute(first, 0)
+    ready = [t for t in tasks[:4] if not t.isComplete()] + tasks[4:]
+    second = scheduler.schedule(ready, annealer)[0]
+
+    kept = [(t, a.origin) for t, a in zip(first.getTasks(), first.getAllocs()) if not t.isComplete()]
+    assert kept
+    assert [(t, a.origin) for t, a in zip(second.getTasks(), second.getAllocs())][:len(kept)] == kept
+    assert scheduler.n_incremental == 1 and scheduler.n_full == 1
+
+
+@pytest.mark.parametrize('scheduler', [StaticScheduler, NextFitTaskPreemption])
+def test_cluster(scheduler):
+
+    tasks = Task.load(randomTasks(60, anneal_time=100, seed=6))
+    annealers = [Chimera((16, 16), name='a'), Chimera((16, 16), name='b'), Chimera((24, 24), program_time=20000, name='c')]
+    sim = QAMTSimulator(tasks, annealers, scheduler())
+    sim.run()
+
+    assert all(t.isComplete() for t in tasks)
+    metrics = sim.getDeviceMetrics()
+    assert set(metrics) == {'a', 'b', 'c', 'cluster'}
+    assert sum(metrics[n]['tasks'] for n in 'abc') == metrics['cluster']['tasks'] == 60
+    assert sum(metrics[n]['instructions'] for n in 'abc') == len(sim.getInstructionComplete())
+    assert all(metrics[n]['instructions'] > 0 for n in 'abc')
+
+    # instructions of one annealer never overlap, and use its program time
+    by_device = {}
+    for inst in sim.getInstructionComplete():
+        by_device.setdefault(inst.getDeviceCapacity(), []).append(inst.getTiming())
+    for capacity, timings in by_device.items():
+        timings.sort()
+        assert all(t_prog == (20000 if capacity == 576 else 12000) for _, _, t_prog, _ in timings)
+    for timings in [t for c, t in by_device.items() if c == 576]:
+        assert all(a[1] <= b[0] for a, b in zip(timings, timings[1:]))
+
+    # the cluster is faster than one annealer
+    single = QAMTSimulator(Task.load(randomTasks(60, anneal_time=100, seed=6)), Chimera(), scheduler())
+    single.run()
+    assert sim.getTime() < single.getTime()
+    assert 0 < metrics['cluster']['utilisation'] <= 1
+
+
+@pytest.mark.parametrize('scheduler', [StaticScheduler, NextFitTaskPreemption, IncrementalScheduler])
+def test_mixed_size_cluster(scheduler):
+
+    tasks = Task.load(randomTasks(30, anneal_time=100, seed=3))
+    large = [t for t in tasks if max(t.getEmbd().shape) > 8]
+    assert large and len(large) < len(tasks)
+
+    sim = QAMTSimulator(tasks, [Chimera((8, 8), name='small'), Chimera((16, 16), name='large')], scheduler())
+    sim.run()
+
+    assert all(t.isComplete() for t in tasks)
+    for inst in sim.getInstructionComplete():
+        if inst.getDeviceCapacity() == 64:
+            assert not any(t in large for t in inst.getTasks())
+    assert sim.getDeviceMetrics()['small']['tasks'] > 0
+
+    with pytest.raises(ValueError, match='does not fit'):
+        QAMTSimulator(Task.load(randomTasks(5, anneal_time=100, seed=3)), [Chimera((4, 4)), Chimera((6, 6))], scheduler()).run()
+
+
+def test_pipelined_annealer():
+
+    tasks = Task.load(randomTasks(60, anneal_time=100, seed=7))
+    annealer = Chimera(pipelined=True)
+    sim = QAMTSimulator(tasks, annealer, NextFitTaskPreemption(), static_scheduling=True)
+    sim.run()
+    assert all(t.isComplete() for t in tasks)
+
+    serial = QAMTSimulator(Task.load(randomTasks(60, anneal_time=100, seed=7)), Chimera(), NextFitTaskPreemption(), static_scheduling=True)
+    serial.run()
+    assert sim.getTime() < serial.getTime()
+    # overlapping instructions are not counted twice as busy time
+    assert sim.getDeviceMetrics()['annealer0']['busy'] <= 1
+    assert serial.getDeviceMetrics()['annealer0']['busy'] <= 1
+
+    timings = sorted(inst.getTiming() for inst in sim.getInstructionComplete())
+    samples = [(t_end - t_sample, t_end) for _, t_end, _, t_sample in timings]
+    # sampling is serial, programming overlaps the sampling before it
+    assert all(a[1] <= b[0] for a, b in zip(samples, samples[1:]))
+    assert any(b[0] < a[1] for a, b in zip(timings, timings[1:]))
+
+
+def test_reuse_program():
+
+    table = TaskTable()
+    tasks = [Task(np.ones((4, 4), dtype=int), num_reads=100, table=table) for _ in range(3)]
+    annealer = Chimera(reuse_program=True)
+    scheduler = NextFitTaskPreemption()
+
+    first = scheduler.schedule(tasks, annealer)[0]
+    t = annealer.execute(first, 0)
+    second = scheduler.schedule(tasks, annealer)[0]
+    annealer.execute(second, t)
+
+    assert first.getTiming()[2] == 12000 and second.getTiming()[2] == 0
+    assert annealer.n_programs == 1 and annealer.n_reused == 1
+
+
+@pytest.mark.parametrize('static', [True, False])
+def test_lookahead(static):
+
+    def run(lookahead):
+        tasks = Task.load(randomTasks(60, anneal_time=100, seed=8))
+        scheduler = StaticScheduler()
+        meter = SchedulerSpeedometer()
+        scheduler.schedule = meter.decorate(scheduler.schedule)
+        QAMTSimulator(tasks, Chimera(), scheduler, static_scheduling=static, lookahead=lookahead).run()
+        return [(t.getLogStartTime(), t.getLogEndTime()) for t in tasks], len(meter.getStats())
+
+    timings, calls = run(False)
+    timings_lookahead, calls_lookahead = run(True)
+
+    assert all(end is not None for _, end in timings_lookahead)
+    if static:
+        # the plan is never invalidated, the scheduler runs once
+        assert timings_lookahead == timings
+        assert calls_lookahead == 1 < calls
+    else:
+        assert calls_lookahead <= calls
+
+
+@pytest.mark.parametrize('scheduler', [DynamicScheduler, TimeSliceScheduler])
+def test_time_slicing_completes_tasks(scheduler):
+
+    tasks = Task.load(randomTasks(40, anneal_time=100, seed=9))
+    sim = QAMTSimulator(tasks, Chimera(), scheduler())
+    sim.run()
+
+    assert all(t.isComplete() for t in tasks)
+    assert all(t.getSampleRemain() == 0 for t in tasks)
+
+
+@pytest.mark.parametrize('policy', ['round_robin', 'fair'])
+def test_time_slice_quantum(policy):
+
+    def run(quantum, unit='samples'):
+        tasks = Task.load(randomTasks(60, anneal_time=100, seed=10))
+        sim = QAMTSimulator(tasks, Chimera(), TimeSliceScheduler(quantum, unit=unit, policy=policy))
+        sim.run()
+        return sim
+
+    short, long = run(50), run(500)
+    assert all(inst.getNumReads() <= 50 for inst in short.getInstructionComplete())
+    # a shorter quantum programs more often
+    assert len(short.getInstructionComplete()) > len(long.getInstructionComplete())
+    assert short.getDeviceMetrics()['cluster']['programming'] > long.getDeviceMetrics()['cluster']['programming']
+
+    # a quantum of 5000 us is 50 samples of 100 us
+    us = run(5000, unit='us')
+    assert [inst.getNumReads() for inst in us.getInstructionComplete()] == [inst.getNumReads() for inst in short.getInstructionComplete()]
+
+
+def test_time_slice_round_robin():
+
+    table = TaskTable()
+    tasks = [Task(np.ones((12, 12), dtype=int), num_reads=300, table=table) for _ in range(3)]
+    annealer = Chimera()
+    scheduler = TimeSliceScheduler(100)
+
+    served = []
+    t = 0
+    for _ in range(6):
+        inst = scheduler.schedule([t for t in tasks if not t.isComplete()], annealer)[0]
+        t = annealer.execute(inst, t)
+        served += inst.getTasks()
+
+    # one task fits at a time, and each is served in turn
+    assert served == tasks * 2
+
+
+def test_time_slice_zero_weights():
+
+    table = TaskTable()
+    tasks = [Task(np.ones((12, 12), dtype=int), num_reads=300, table=table) for _ in range(3)]
+    annealer = Chimera()
+    scheduler = TimeSliceScheduler(100, policy='fair', weights=lambda task: 0)
+
+    served = []
+    t = 0
+    for _ in range(6):
+        inst = scheduler.schedule([t for t in tasks if not t.isComplete()], annealer)[0]
+        t = annealer.execute(inst, t)
+        served += inst.getTasks()
+
+    # weights of 0 fall back to equal shares
+    assert served == tasks * 2
+
+
+def test_unknown_time_slice_options():
+
+    with pytest.raises(ValueError):
+        TimeSliceScheduler(unit='ms')
+    with pytest.raises(ValueError):
+        TimeSliceScheduler(policy='lottery')
+
+
+def test_edf_orders_by_deadline():
+
+    table = TaskTable()
+    tasks = [Task(np.ones((12, 12), dtype=int), name=n, num_reads=r, anneal_time=100, deadline=d, table=table)
+             for n, r, d in [('late', 100, 90000), ('none', 100, None), ('early', 100, 30000), ('long', 500, 60000)]]
+    annealer = Chimera()
+
+    assert EDFScheduler().schedule(tasks, annealer)[0].getTasks() == [tasks[2]]
+    # the long task has 10 ms of laxity, the early one 20 ms
+    assert LeastLaxityScheduler().schedule(tasks, annealer)[0].getTasks() == [tasks[3]]
+    assert EDFScheduler().schedule(tasks[:2], annealer)[0].getTasks() == [tasks[0]]
+
+
+@pytest.mark.parametrize('scheduler', [EDFScheduler, LeastLaxityScheduler])
+def test_deadline_schedulers(scheduler):
+
+    def run(scheduler):
+        tasks = Task.load(randomTasks(100, anneal_time=100, seed=11, deadline=3))
+        QAMTSimulator(tasks, Chimera(), scheduler).run()
+        assert all(t.isComplete() for t in tasks)
+        return DeadlineMetrics(tasks)
+
+    urgent = run(scheduler(quantum=200))
+    assert urgent.count() == 100
+    assert urgent.missRate() < run(NextFitTaskPreemption()).missRate()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import json
+
+from qamts.sweep import Sweep, bestParams, paramGrid, runSimulation, toColumns
+
+
+def test_sweep_is_resumable(tmp_path):
+
+    path = tmp_path / 'results.ndjson'
+    grid = paramGrid(scheduler=['StaticScheduler', 'NextFitTaskPreemption'], seed=[0, 1], num_tasks=[10])
+
+    rows = Sweep(grid[:3], path, max_workers=2).run()
+    assert len(rows) == 3
+
+    rows = Sweep(grid, path, max_workers=0).run()
+    assert len(rows) == 4
+    with open(path) as f:
+        assert len(f.readlines()) == 4
+
+    # a sweep killed while writing leaves a partial last line
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'w') as f:
+        f.writelines(lines[:-1] + [lines[-1][:len(lines[-1]) // 2]])
+    rows = Sweep(grid, path, max_workers=0).run()
+    assert len(rows) == 4
+    with open(path) as f:
+        assert [json.loads(line) for line in f][:3] == [json.loads(line) for line in lines[:3]]
+
+    # a complete last line without its newline is kept and ended
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'w') as f:
+        f.writelines(lines[:-2] + [lines[-2].rstrip('\n')])
+    rows = Sweep(grid, path, max_workers=0).run()
+    assert len(rows) == 4
+    with open(path) as f:
+        done = [json.loads(line) for line in f]
+    assert sorted((r['scheduler'], r['seed']) for r in done) == sorted((p['scheduler'], p['seed']) for p in grid)
+
+    table = toColumns(rows)
+    assert sorted(zip(table['scheduler'], table['seed'])) == sorted((p['scheduler'], p['seed']) for p in grid)
+    assert all(0 < u <= 1 for u in table['utilisation'])
+
+
+def test_best_params():
+
+    grid = paramGrid(scheduler=['TimeSliceScheduler'], scheduler_kwargs=[{'quantum': 20}, {'quantum': 1000}], seed=[0, 1], num_tasks=[10])
+    rows = Sweep(grid, max_workers=0).run()
+
+    assert all(0 <= row['programming_overhead'] < 1 for row in rows)
+    best, means = bestParams(rows, 'scheduler_kwargs', 'programming_overhead')
+    assert best == {'quantum': 1000}
+    assert [value for value, _ in means] == [{'quantum': 1000}, {'quantum': 20}]
+
+
+def test_deadline_metrics_of_run():
+
+    row = runSimulation({'scheduler': 'EDFScheduler', 'num_tasks': 20, 'deadline': 3})
+    assert row['deadlines'] == 20 and 0 <= row['miss_rate'] <= 1
+    assert 'miss_rate' not in runSimulation({'scheduler': 'EDFScheduler', 'num_tasks': 20})
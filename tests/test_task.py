@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from qamts.embedding import EmbeddingCache, EmbeddingInfo, decodeEmbedding, embeddingInfo, embeddingSize, encodeEmbedding
+from qamts.task import Task, TaskTable
+from qamts.utils import randomTasks
+
+
+def test_load_shares_embeddings():
+
+    tasks = Task.load(randomTasks(200, seed=0))
+    embds = {id(t.getEmbd()) for t in tasks}
+    shapes = {t.getEmbd().shape for t in tasks}
+
+    assert len(embds) == len(shapes)
+    assert not tasks[0].getEmbd().flags.writeable
+
+    info = embeddingInfo(tasks[0].getEmbd())
+    assert info is embeddingInfo(tasks[0].getEmbd())
+    assert info.all_ones and info.sum == tasks[0].getEmbd().sum()
+
+
+@pytest.mark.parametrize('fmt', ['rle', 'bits'])
+def test_embedding_spec_round_trip(fmt):
+
+    rng = np.random.default_rng(0)
+    for shape in [(1, 1), (3, 5), (7, 2)]:
+        embd = (rng.random(shape) < 0.5).astype(int)
+        spec = encodeEmbedding(embd, fmt)
+        assert np.array_equal(decodeEmbedding(spec), embd)
+
+    assert encodeEmbedding(np.ones((2, 3), dtype=int)) == {'shape': [2, 3]}
+
+
+@pytest.mark.parametrize('spec', [
+    {'shape': [2]},
+    {'shape': [0, 3]},
+    {'shape': [-2, -3]},
+    {'shape': [2.5, 3]},
+    {'shape': [True, 3]},
+    {'shape': ['2', 3]},
+    {'shape': [1 << 20, 1 << 20]},
+    {'shape': [2, 2], 'rle': [0, 3]},
+    {'shape': [2, 2], 'rle': [1.5, 2.5]},
+    {'shape': [2, 2], 'rle': [-1, 5]},
+    {'shape': [2, 2], 'rle': [True, 3]},
+    {'shape': [2, 2], 'rle': [1 << 70, 4]},
+])
+def test_invalid_embedding_spec(spec):
+
+    with pytest.raises(ValueError):
+        decodeEmbedding(spec)
+
+
+def test_load_embedding_formats():
+
+    data = [
+        {'name': 'a', 'embd': {'shape': [2, 3]}},
+        {'name': 'b', 'embd': {'shape': [2, 2], 'rle': [0, 3, 1]}},
+        {'name': 'c', 'embd': 'np.ones((2, 3), dtype=int)'},
+        {'name': 'd', 'embd': 'embd = np.eye(2, dtype=int)'},
+    ]
+
+    a, b, c, d = Task.load(data, trusted=True)
+
+    assert a.getEmbd() is c.getEmbd()
+    assert np.array_equal(b.getEmbd(), [[1, 1], [1, 0]])
+    assert np.array_equal(d.getEmbd(), np.eye(2))
+
+    # Python source is only evaluated on request
+    with pytest.raises(ValueError, match='trusted=True'):
+        Task.load({'embd': 'np.ones((2, 2))'})
+    with pytest.raises(ValueError):
+        Task.load({'embd': 'np.ones((2, 2))'}, trusted=False)
+
+
+def test_task_table_views():
+
+    table = TaskTable(keep_logs=False)
+    tasks = Task.load(randomTasks(5, anneal_time=100, seed=0), table=table)
+
+    assert len(table) == 5
+    assert table[2] == tasks[2] and hash(table[2]) == hash(tasks[2])
+    assert table[2] != tasks[3]
+    assert not hasattr(tasks[0], '__dict__')
+
+    tasks[1].log('program', (10, 12000), 1)
+    tasks[1].log('sample', (12010, 12110), 50)
+    tasks[1].samplePlusOne(50)
+
+    assert tasks[1].getLogStartTime() == 10
+    assert tasks[1].getLogEndTime() == 12010 + 100 * 50
+    assert tasks[1].getLogs() == []
+    assert tasks[0].getLogStartTime() is None
+    assert table.column('samples_complete').tolist() == [0, 50, 0, 0, 0]
+    assert table.column('embd_sum').tolist() == [t.getEmbd().sum() for t in tasks]
+
+
+def test_standalone_task():
+
+    task = Task(np.ones((2, 2), dtype=int), name='a', num_reads=10)
+    task.log('sample', (0, 20), 10)
+
+    assert task.name == 'a' and task.getSampleRemain() == 10
+    assert task.getLogs() == [('sample', (0, 20), 10)]
+
+
+def test_deadline_and_priority():
+
+    tasks = Task.load(randomTasks(5, anneal_time=100, seed=0, deadline=2))
+    assert all(t.getDeadline() == t.getTimeArrive() + 2 * t.getNumSamples() * 100 for t in tasks)
+    assert all(t.getPriority() == 1 for t in tasks)
+
+    task = Task(np.ones((2, 2), dtype=int), num_reads=10, anneal_time=100, deadline=5000, priority=3)
+    assert task.getDeadline() == 5000 and task.getPriority() == 3
+    assert task.getLaxity(1000) == 3000
+    task.samplePlusOne(4)
+    assert task.getLaxity(1000) == 3400
+    assert Task(np.ones((2, 2), dtype=int)).getLaxity(0) is None
+
+
+def test_deadline_and_priority_types():
+
+    task = Task(np.ones((2, 2), dtype=int), deadline=1500.5, priority=0.5)
+    assert task.getDeadline() == 1500 and task.getPriority() == 0.5
+
+    table = TaskTable()
+    task, = table.extend([{'embd': np.ones((2, 2), dtype=int), 'deadline': 7.6, 'priority': 2}])
+    assert task.getDeadline() == 8 and task.getPriority() == 2
+    assert table.column('priority').tolist() == [2.0]
+
+    for priority in [0, -1, float('nan'), 'high']:
+        with pytest.raises(ValueError, match='priority'):
+            Task(np.ones((2, 2), dtype=int), priority=priority)
+    with pytest.raises(ValueError, match='deadline'):
+        Task(np.ones((2, 2), dtype=int), deadline='soon')
+
+
+def test_embedding_cache_is_bounded():
+
+    cache = EmbeddingCache(maxsize=3)
+    embds = [cache.intern(np.ones((1, n), dtype=int)) for n in range(1, 5)]
+    assert len(cache) == 3 and len(cache.infos) == 3
+
+    # the first one was dropped, it still gets a correct info
+    assert cache.getInfo(embds[0]).sum == 1
+    assert cache.getInfo(embds[3]) is cache.getInfo(embds[3])
+    assert cache.intern(np.ones((1, 4), dtype=int)) is embds[3]
+
+    cache.clear()
+    assert len(cache) == 0 and not cache.infos
+
+
+def test_embedding_info_is_lazy():
+
+    embd = np.array([[1, 1], [0, 1]])
+    info = EmbeddingInfo(embd)
+    assert 'orientations' not in vars(info)
+    assert info.sum == 3 and 'orientations' not in vars(info)
+    assert len(info.orientations) == 4 and 'orientations' in vars(info)
+
+    # the size of an embedding that is not interned is its sum
+    assert embeddingSize(embd) == 3
+    assert embeddingSize(Task.load({'embd': {'shape': [2, 3]}}).getEmbd()) == 6
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import pytest
+
+from qamts.annealer import Chimera
+from qamts.metrics import TaskTiming, calcResourceUtilisation
+from qamts.scheduler import NextFitTaskPreemption, StaticScheduler
+from qamts.simulator import QAMTSimulator
+from qamts.task import Task
+from qamts.trace import RECORD, BinaryTraceWriter, TraceReader
+from qamts.utils import randomTasks
+
+
+@pytest.mark.parametrize('scheduler', [StaticScheduler, NextFitTaskPreemption])
+def test_binary_trace(scheduler, tmp_path):
+
+    path = tmp_path / 'trace.bin'
+    tasks = Task.load(randomTasks(40, anneal_time=100, seed=3))
+    with BinaryTraceWriter(path, buffer_size=16) as writer:
+        sim = QAMTSimulator(tasks, Chimera(), scheduler(), sink=writer)
+        sim.run()
+    insts = sim.getInstructionComplete()
+
+    trace = TraceReader(path)
+    assert trace.shape == (16, 16)
+    assert len(trace) == sum(len(inst.getTasks()) for inst in insts)
+    assert trace.numInstructions() == len(insts)
+    assert sorted(trace.names()) == sorted(t.name for t in tasks)
+
+    first = trace.instructions()
+    assert first['t_start'].tolist() == [inst.getTiming()[0] for inst in insts]
+    assert first['t_end'].tolist() == [inst.getTiming()[1] for inst in insts]
+    assert trace.usage() == pytest.approx([sum(a.sum() for a in inst.getAllocs()) / 256 for inst in insts])
+    assert trace.utilisation() == pytest.approx(calcResourceUtilisation(insts))
+
+    tt, expected = trace.taskTiming(chunk_size=7), TaskTiming(tasks)
+    assert tt.summary() == pytest.approx(expected.summary())
+
+
+def test_trace_tolerates_partial_record(tmp_path):
+
+    path = tmp_path / 'trace.bin'
+    tasks = Task.load(randomTasks(10, anneal_time=100, seed=4))
+    with BinaryTraceWriter(path, names=False) as writer:
+        QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption(), sink=writer).run()
+    n = len(TraceReader(path))
+    with open(path, 'ab') as f:
+        f.write(b'\0' * (RECORD.itemsize // 2))
+
+    trace = TraceReader(path)
+    assert len(trace) == n
+    assert trace.names() is None
+
+
+def test_not_a_trace(tmp_path):
+
+    path = tmp_path / 'trace.bin'
+    path.write_bytes(b'not a trace at all')
+    with pytest.raises(ValueError):
+        TraceReader(path)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import csv
+import json
+
+import pytest
+
+from qamts.annealer import Chimera
+from qamts.scheduler import NextFitTaskPreemption
+from qamts.simulator import QAMTSimulator
+from qamts.task import Task
+from qamts.utils import randomTasks
+from qamts.workload import readTasks, writeTasks
+
+
+def simulate(tasks):
+    sim = QAMTSimulator(tasks, Chimera(), NextFitTaskPreemption())
+    sim.run()
+    return sorted((t.name, t.getLogStartTime(), t.getLogEndTime()) for t in sim.task_complete)
+
+
+def test_stream_ndjson(tmp_path):
+
+    path = tmp_path / 'tasks.ndjson'
+    writeTasks(path, randomTasks(30, anneal_time=100, seed=0))
+
+    streamed = simulate(readTasks(path, chunk_size=7))
+    loaded = simulate(Task.load(randomTasks(30, anneal_time=100, seed=0)))
+
+    assert streamed == loaded
+
+
+def test_stream_csv(tmp_path):
+
+    path = tmp_path / 'tasks.csv'
+    tasks = randomTasks(10, anneal_time=100, seed=0)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(tasks[0]))
+        writer.writeheader()
+        for t in tasks:
+            writer.writerow(dict(t, embd=json.dumps(t['embd'])))
+
+    streamed = list(readTasks(path))
+
+    assert [t.name for t in streamed] == [t['name'] for t in tasks]
+    assert [t.getTimeArrive() for t in streamed] == [t['t_arrive'] for t in tasks]
+    assert [t.getEmbd().shape for t in streamed] == [tuple(t['embd']['shape']) for t in tasks]
+
+
+def test_stream_must_be_sorted():
+
+    tasks = Task.load(randomTasks(5, anneal_time=100, seed=0))
+    sim = QAMTSimulator(iter(tasks[::-1]), Chimera(), NextFitTaskPreemption())
+
+    with pytest.raises(ValueError):
+        sim.run()
+
+
+def test_csv_fractional_times(tmp_path):
+
+    path = tmp_path / 'tasks.csv'
+    path.write_text('name,embd,num_reads,anneal_time,t_arrive\n'
+                    'a,"{""shape"": [2, 2]}",100,20.4,0\n'
+                    'b,"{""shape"": [3, 3]}",100,20,1500.6\n')
+
+    a, b = readTasks(path)
+    assert (a.getAnnealTime(), a.getTimeArrive()) == (20, 0)
+    assert (b.getAnnealTime(), b.getTimeArrive()) == (20, 1501)
+
+    path.write_text('name,embd,num_reads\na,"{""shape"": [2, 2]}",100.5\n')
+    with pytest.raises(ValueError, match='num_reads'):
+        list(readTasks(path))